@@ -0,0 +1,231 @@
+import argparse
+import multiprocessing
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import time
+import timeit
+
+import protocol
+import server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# workers: forwarding throughput vs. jumlah worker SO_REUSEPORT
+def blast_client(host, seconds, size, counter, ready):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 4)
+    sock.setblocking(False)
+    # Fragmen video tunggal yang valid (versi protokol benar), supaya server benar-benar meneruskannya
+    name = f"bench{os.getpid()}".encode()
+    header_len = len(protocol.pack_video_header(1, 0, 0, 1, 0, name, 0))
+    body = max(size - header_len, 1)
+    payload = protocol.pack_video_header(1, body, 0, 1, 0, name, 0) + os.urandom(body)
+    dest = (host, server.UDP_PORT)
+    sock.sendto(payload, dest)
+    ready.wait()
+    received = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try: sock.sendto(payload, dest)
+        except OSError: pass
+        for _ in range(64):
+            try: sock.recv(65536)
+            except BlockingIOError: break
+            received += 1
+    with counter.get_lock():
+        counter.value += received
+
+
+def run_workers_case(host, workers, clients, seconds, size):
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py'), '--workers', str(workers)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)
+        counter = multiprocessing.Value('q', 0)
+        ready = multiprocessing.Event()
+        procs = [multiprocessing.Process(target=blast_client, args=(host, seconds, size, counter, ready))
+                 for _ in range(clients)]
+        for p in procs: p.start()
+        time.sleep(server.SWEEP_INTERVAL * 2)  # tunggu registry tersebar ke semua worker
+        ready.set()
+        for p in procs: p.join()
+        return counter.value / seconds
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def bench_workers(args):
+    print(f"clients={args.clients} size={args.size}B seconds={args.seconds} cpus={os.cpu_count()}")
+    print(f"{'workers':>8} {'fwd pkt/s':>12} {'speedup':>8}")
+    base = None
+    for w in range(1, args.max_workers + 1):
+        pps = run_workers_case(args.host, w, args.clients, args.seconds, args.size)
+        base = base or pps or 1
+        print(f"{w:>8} {pps:>12.0f} {pps / base:>8.2f}x")
+
+
+# wire: pickle dict lama vs. framing biner protocol.py
+def bench_wire(args):
+    user = "participant-01"
+    user_b = user.encode('utf-8')
+    pcm = os.urandom(args.samples * 2)
+    cases = [
+        ("hello", {'type': 'hello', 'u': user}, (protocol.HELLO, b'')),
+        ("offcam", {'type': 'offcam', 'u': user, 'mute': True, 'deaf': False},
+         (protocol.OFFCAM, bytes((protocol.pack_flags(True, False),)))),
+        ("audio", {'type': 'audio', 'u': user, 'd': pcm}, (protocol.AUDIO, pcm)),
+    ]
+    n = args.iterations
+    print(f"{'msg':>8} {'path':>7} {'bytes':>7} {'encode ns':>10} {'decode ns':>10} {'header ns':>10}")
+    for name, obj, (kind, body) in cases:
+        pk = pickle.dumps(obj, 5)
+        enc = timeit.timeit(lambda: pickle.dumps(obj, 5), number=n) / n * 1e9
+        dec = timeit.timeit(lambda: pickle.loads(pk), number=n) / n * 1e9
+        print(f"{name:>8} {'pickle':>7} {len(pk):>7} {enc:>10.0f} {dec:>10.0f} {dec:>10.0f}")
+        bn = protocol.pack_ctrl(kind, user_b, body)
+        enc = timeit.timeit(lambda: protocol.pack_ctrl(kind, user_b, body), number=n) / n * 1e9
+        dec = timeit.timeit(lambda: protocol.unpack_ctrl(bn), number=n) / n * 1e9
+        head = timeit.timeit(lambda: protocol.parse_ctrl(bn), number=n) / n * 1e9
+        print(f"{name:>8} {'binary':>7} {len(bn):>7} {enc:>10.0f} {dec:>10.0f} {head:>10.0f}")
+
+
+# delta: JPEG penuh tiap frame vs. keyframe + tile berubah (codec.py)
+def synthetic_frames(n, w, h, noise):
+    import cv2
+    import numpy as np
+    rng = np.random.default_rng(1)
+    bg = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), np.uint8), (0, 0), 8)
+    bg = cv2.normalize(bg, None, 0, 255, cv2.NORM_MINMAX)
+    for i in range(n):
+        f = bg.copy()
+        # "Kepala" yang bergoyang pelan dan "mulut" yang membuka-tutup; latar statis
+        cx, cy = w // 2 + int(20 * np.sin(i / 15)), h // 2 + int(8 * np.sin(i / 9))
+        cv2.ellipse(f, (cx, cy), (w // 10, h // 4), 0, 0, 360, (90, 140, 200), -1)
+        cv2.ellipse(f, (cx, cy + h // 10), (w // 40, 2 + int(10 * abs(np.sin(i / 3)))), 0, 0, 360, (40, 40, 120), -1)
+        if noise: f = cv2.add(f, rng.integers(0, noise + 1, f.shape, np.uint8))
+        yield f
+
+
+def video_frames(path, n, w, h):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    for _ in range(n):
+        ok, f = cap.read()
+        if not ok: break
+        yield cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA) if f.shape[:2] != (h, w) else f
+
+
+def bench_delta(args):
+    import cv2
+    import numpy as np
+    import codec
+    frames = video_frames(args.video, args.frames, args.width, args.height) if args.video else \
+        synthetic_frames(args.frames, args.width, args.height, args.noise)
+    enc = codec.DeltaEncoder(keyframe_interval=args.keyframe_interval)
+    dec = codec.DeltaDecoder()
+    full_bytes = delta_bytes = n = 0
+    full_t = delta_t = 0.0
+    psnr = []
+    for i, f in enumerate(frames):
+        t0 = time.perf_counter()
+        _, jpg = cv2.imencode('.jpg', f, [int(cv2.IMWRITE_JPEG_QUALITY), args.quality])
+        t1 = time.perf_counter()
+        payload, is_delta = enc.encode(f, args.quality, i, now=i / args.fps)
+        t2 = time.perf_counter()
+        full_t += t1 - t0; delta_t += t2 - t1
+        full_bytes += len(jpg); delta_bytes += len(payload); n += 1
+        out = dec.decode(payload, i, is_delta)
+        if out is not None: psnr.append(cv2.PSNR(f, out))
+    if not n: return print("no frames")
+    kbps = lambda b: b * 8 / 1000 / (n / args.fps)
+    print(f"frames={n} {args.width}x{args.height} q={args.quality} fps={args.fps} "
+          f"keyframes={enc.keyframes} deltas={enc.deltas}")
+    print(f"{'path':>6} {'B/frame':>9} {'kbps':>9} {'enc ms':>7}")
+    print(f"{'full':>6} {full_bytes / n:>9.0f} {kbps(full_bytes):>9.0f} {full_t / n * 1000:>7.2f}")
+    print(f"{'delta':>6} {delta_bytes / n:>9.0f} {kbps(delta_bytes):>9.0f} {delta_t / n * 1000:>7.2f}")
+    print(f"delta/full = {delta_bytes / full_bytes:.3f}  reconstruction PSNR min/mean = "
+          f"{min(psnr):.1f}/{float(np.mean(psnr)):.1f} dB")
+
+
+# mix: CPU server untuk audio N peserta, forwarding N*(N-1) paket vs. MCU N paket per frame
+def bench_mix(args):
+    import numpy as np
+    import mixer
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    dest = sink.getsockname()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    rng = np.random.default_rng(1)
+    frames = int(args.seconds / (mixer.AUDIO_FRAME / mixer.AUDIO_RATE))
+
+    def send(data):
+        try: sock.sendto(data, dest)
+        except OSError: pass
+
+    print(f"{args.seconds:.0f}s of audio, every participant talking, loopback sink")
+    print(f"{'N':>4} {'path':>8} {'pkt/s out':>10} {'cpu ms/s':>9}")
+    for n in args.participants:
+        pcm = [(rng.standard_normal(mixer.AUDIO_FRAME) * 3000).astype(np.int16).tobytes() for _ in range(n)]
+        users = [f"user{i:02d}".encode() for i in range(n)]
+        t0 = time.process_time()
+        for f in range(frames):
+            for s in range(n):
+                packet = protocol.pack_ctrl(protocol.AUDIO, users[s], protocol.pack_audio(f, pcm[s], 30))
+                for _ in range(n - 1): send(packet)
+        fwd = time.process_time() - t0
+        m = mixer.Mixer()
+        receivers = list(range(n))
+        t0 = time.process_time()
+        for f in range(frames):
+            for s in range(n):
+                packet = protocol.pack_ctrl(protocol.AUDIO, users[s], protocol.pack_audio(f, pcm[s], 30))
+                head = protocol.parse_ctrl(packet)
+                seq, level, body = protocol.unpack_audio(packet[head[1]:])
+                m.push(s, seq, level, body)
+            for r, body in m.mix(receivers, 0.0): send(protocol.pack_ctrl(protocol.AUDIO, m.user, body))
+        mix = time.process_time() - t0
+        print(f"{n:>4} {'forward':>8} {n * (n - 1) * frames / args.seconds:>10.0f} {fwd / args.seconds * 1000:>9.1f}")
+        print(f"{n:>4} {'mix':>8} {n * frames / args.seconds:>10.0f} {mix / args.seconds * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Locus benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("workers", help="UDP fan-out scaling vs. --workers on loopback")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--seconds", type=float, default=5)
+    p.add_argument("--size", type=int, default=1200)
+    p.set_defaults(fn=bench_workers)
+
+    p = sub.add_parser("wire", help="encode/decode cost and size: pickle vs. binary control framing")
+    p.add_argument("--samples", type=int, default=512, help="int16 samples per audio packet")
+    p.add_argument("--iterations", type=int, default=200000)
+    p.set_defaults(fn=bench_wire)
+
+    p = sub.add_parser("delta", help="bandwidth of full-frame JPEG vs. keyframe + changed tiles")
+    p.add_argument("--video", help="video file to use instead of the synthetic talking-head scene")
+    p.add_argument("--frames", type=int, default=300)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--quality", type=int, default=85)
+    p.add_argument("--fps", type=float, default=30)
+    p.add_argument("--noise", type=int, default=2, help="sensor noise amplitude of the synthetic scene")
+    p.add_argument("--keyframe-interval", type=float, default=2.0, help="seconds of video between keyframes")
+    p.set_defaults(fn=bench_delta)
+
+    p = sub.add_parser("mix", help="server CPU for audio: plain forwarding vs. MCU mixing (--mix)")
+    p.add_argument("--participants", type=int, nargs="+", default=[4, 8, 16, 32])
+    p.add_argument("--seconds", type=float, default=5)
+    p.set_defaults(fn=bench_mix)
+
+    args = parser.parse_args()
+    args.fn(args)
@@ -5,8 +5,8 @@ import cv2
 import numpy as np
 import pickle
 import time
+import heapq
 import sounddevice as sd
-import struct
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QGridLayout, 
                              QVBoxLayout, QHBoxLayout, QPushButton, QLabel, 
                              QFrame, QSizePolicy, QInputDialog, QMessageBox, 
@@ -14,6 +14,8 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QGridLayout,
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, pyqtSlot, QSize, QTimer, QPropertyAnimation, QEasingCurve, QRect
 from PyQt6.QtGui import QImage, QPixmap, QPainter, QColor, QFont, QPen, QIcon, QBrush
 import os
+import protocol
+import codec
 
 
 os.environ["QT_QUICK_CONTROLS_STYLE"] = "Material"
@@ -23,7 +25,52 @@ UDP_PORT, TCP_PORT = 9999, 9997
 VIDEO_W, VIDEO_H = 1280, 720 
 FPS = 30
 JPEG_QUAL = 95
-MAX_PACKET_SIZE = 60000 
+MAX_PACKET_SIZE = 1200      # payload per datagram; di bawah MTU supaya tidak kena fragmentasi IP
+FEC_RATIO = 0.1             # paket parity XOR per paket data (0 = FEC mati)
+# Pacing: fragmen satu frame disebar dalam PACE_SPREAD x interval frame, bukan dikirim sekaligus
+PACING = True
+PACE_SPREAD = 0.8
+PACE_BURST = 8 * MAX_PACKET_SIZE    # byte yang boleh keluar beruntun tanpa menunggu
+PACE_MIN_WINDOW = 0.002
+SEND_TIMESTAMPS = True      # waktu kirim di header fragmen -> penerima mengukur variasi delay satu arah
+ENCODE_WORKERS = 2          # thread filter/encode; cv2 melepas GIL sehingga bisa paralel
+DECODE_WORKERS = 2          # thread decode frame masuk; satu pengirim hanya ditangani satu thread sekaligus
+DELTA_CODEC = True          # keyframe + tile berubah saja (codec.py); False = JPEG penuh tiap frame
+KEYFRAME_REQ_INTERVAL = 0.5 # jeda minimal permintaan keyframe ke satu pengirim
+
+AUDIO_RATE = 22050
+AUDIO_BLOCK = 441           # 20 ms per paket audio
+JITTER_MIN, JITTER_MAX = 2, 12      # kedalaman jitter buffer dalam frame
+MAX_CONCEAL = 5             # frame hilang berturut-turut yang disamarkan sebelum diam
+SPEAKER_TIMEOUT = 2.0
+# VAD pengirim: energi di atas noise floor adaptif + zero-crossing, dengan hangover
+VAD_ENABLED = True
+VAD_MARGIN = 9              # dB di atas noise floor supaya dianggap bicara
+VAD_FLOOR_RISE = 0.02       # dB per frame noise floor boleh naik (lantai turun seketika)
+VAD_FLOOR_MAX = 90          # -dBov; lantai tidak lebih sunyi dari ini (diam digital bukan noise)
+VAD_ZCR_NOISE = 0.35        # zero-crossing rate setinggi ini = desis, kecuali energinya jauh di atas lantai
+VAD_HANGOVER = 15           # frame (300 ms) tetap dikirim setelah bicara berhenti
+CN_INTERVAL = 1.0           # pembaruan comfort noise selama diam (harus < SPEAKER_TIMEOUT)
+
+# Rate control layer 0: (w, h, jpeg quality, fps) dari kualitas tertinggi ke terendah
+RATE_LADDER = [(1280, 720, 95, 30), (1280, 720, 85, 30), (1280, 720, 75, 30), (960, 540, 75, 30),
+               (960, 540, 65, 24), (640, 360, 65, 24), (640, 360, 55, 15), (480, 270, 50, 15),
+               (320, 180, 50, 10)]
+TARGET_KBPS = 20000
+FEEDBACK_INTERVAL = 1.0
+LOSS_HIGH, LOSS_SEVERE = 0.05, 0.2
+COMPLETION_LOW = 0.9
+JITTER_HIGH = 40            # ms
+UP_AFTER = 3                # interval bersih berturut-turut sebelum naik satu level
+
+# Simulcast: layer 0 selalu dikirim; set ke 2 atau 3 untuk ikut mengirim layer kecil
+SIMULCAST_LAYERS = 1
+LAYERS = [(VIDEO_W, VIDEO_H, JPEG_QUAL), (640, 360, 80), (320, 180, 70)]   # (w, h, jpeg quality)
+LAYER_REQ_INTERVAL = 1000   # ms; juga interval kirim langganan (SUBSCRIBE)
+SMALL_TILE_H = 240          # tile lebih pendek dari ini cukup SMALL_TILE_FPS
+SMALL_TILE_FPS = 15
+FRAME_POOL_RING = 4         # buffer per peserta: sedang ditulis + menunggu render + sedang tampil + cadangan
+MAX_RENDER_HZ = 60          # batas timer render grid (mengikuti refresh rate layar bila lebih rendah)
 
 STYLESHEET = """
 QMainWindow, QDialog { background-color: #121212; }
@@ -42,6 +89,17 @@ QTextEdit {
 """
 
 # HELPERS
+def fit_size(w, h, box_w, box_h):
+    """Size of a w x h image scaled to fit inside box_w x box_h, keeping the aspect ratio."""
+    scale = min(box_w / w, box_h / h)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+def audio_level(samples):
+    """RFC 6464 style level of float samples: -dBov clamped to 0..127."""
+    rms = float(np.sqrt(np.mean(np.square(samples))))
+    if rms <= 0: return protocol.LEVEL_SILENT
+    return max(0, min(protocol.LEVEL_SILENT, int(-20 * np.log10(min(rms, 1.0)))))
+
 def create_locus_icon(size=64, font_size=40):
     pixmap = QPixmap(size, size)
     pixmap.fill(QColor(0,0,0,0))
@@ -154,21 +212,59 @@ class ToastOverlay(QLabel):
 
 # card
 class VideoCard(QWidget):
+    sig_pin = pyqtSignal(str)
+
     def __init__(self, username):
         super().__init__()
         self.username = username
+        self.pinned = False
         self.frame = None
+        self.pixmap = None      # frame yang sudah diskalakan, dipakai ulang sampai frame/ukuran berubah
         self.is_off = True; self.is_mute = False; self.is_deaf = False
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.setMinimumSize(320, 180)
         self.font_name = QFont("Segoe UI", 11, QFont.Weight.Bold)
         self.font_icon = QFont("Segoe UI Emoji", 20)
         self.font_big = QFont("Segoe UI", 18, QFont.Weight.Bold)
+        self.font_stats = QFont("Consolas", 9)
+        self.overlay = None     # baris metrik (tombol Stats); None = tidak digambar
+        self.slot = None        # FrameSlot milik self.frame; dilepas begitu frame diganti
 
-    def update_data(self, qimage, mute, deaf, off):
+    def update_data(self, qimage, mute, deaf, off, slot=None):
+        if qimage is not self.frame: self.pixmap = None
+        if slot is not self.slot:
+            if self.slot is not None: self.slot.release()
+            self.slot = slot
         self.frame = qimage; self.is_mute = mute; self.is_deaf = deaf; self.is_off = off
         self.update()
 
+    def resizeEvent(self, event):
+        self.pixmap = None
+        super().resizeEvent(event)
+
+    def set_overlay(self, lines):
+        if lines != self.overlay:
+            self.overlay = lines
+            self.update()
+
+    def mouseDoubleClickEvent(self, event):
+        self.sig_pin.emit(self.username)
+
+    def draw_size(self):
+        """Video area in device pixels; the backend decodes/resizes received frames to fit it."""
+        dpr = self.devicePixelRatioF()
+        return max(1, int((self.width() - 8) * dpr)), max(1, int((self.height() - 8) * dpr))
+
+    def scaled_pixmap(self):
+        if self.pixmap is None:
+            w, h = fit_size(self.frame.width(), self.frame.height(), *self.draw_size())
+            img = self.frame
+            if (img.width(), img.height()) != (w, h):
+                img = img.scaled(w, h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.pixmap = QPixmap.fromImage(img)
+            self.pixmap.setDevicePixelRatio(self.devicePixelRatioF())
+        return self.pixmap
+
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
@@ -179,14 +275,11 @@ class VideoCard(QWidget):
         draw_rect = rect.adjusted(4,4,-4,-4)
         
         if not self.is_off and self.frame:
-            img_w, img_h = self.frame.width(), self.frame.height()
-            draw_w, draw_h = draw_rect.width(), draw_rect.height()
-            scale = min(draw_w/img_w, draw_h/img_h)
-            new_w, new_h = int(img_w*scale), int(img_h*scale)
-            x = draw_rect.x() + (draw_w - new_w) // 2
-            y = draw_rect.y() + (draw_h - new_h) // 2
-            scaled = self.frame.scaled(new_w, new_h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            painter.drawPixmap(x, y, QPixmap.fromImage(scaled))
+            pixmap = self.scaled_pixmap()
+            size = pixmap.deviceIndependentSize()
+            x = draw_rect.x() + (draw_rect.width() - int(size.width())) // 2
+            y = draw_rect.y() + (draw_rect.height() - int(size.height())) // 2
+            painter.drawPixmap(x, y, pixmap)
         else:
             painter.setPen(QColor("#555")); painter.setFont(self.font_big)
             painter.drawText(draw_rect, Qt.AlignmentFlag.AlignCenter, "CAMERA OFF")
@@ -205,20 +298,329 @@ class VideoCard(QWidget):
         current_y = draw_rect.top() + margin
         painter.setFont(self.font_icon)
         
-        def draw_icon(emoji, color_line="#ff4444"):
+        def draw_icon(emoji, color_line="#ff4444", crossed=True):
             painter.setPen(QColor("white"))
             icon_rect = QRect(current_x, current_y, icon_size, icon_size)
             painter.drawText(icon_rect, Qt.AlignmentFlag.AlignCenter, emoji)
+            if not crossed: return
             pen = QPen(QColor(color_line)); pen.setWidth(3); pen.setCapStyle(Qt.PenCapStyle.RoundCap)
             painter.setPen(pen)
             painter.drawLine(current_x + 5, current_y + 5, current_x + icon_size - 5, current_y + icon_size - 5)
 
+        if self.pinned: draw_icon("📌", crossed=False); current_x -= (icon_size + 5)
         if self.is_deaf: draw_icon("🎧"); current_x -= (icon_size + 5)
         if self.is_mute: draw_icon("🎙️")
 
+        if self.overlay:
+            painter.setFont(self.font_stats)
+            fm = painter.fontMetrics()
+            line_h = fm.height()
+            box = QRect(draw_rect.left() + margin, draw_rect.top() + margin,
+                        max(fm.horizontalAdvance(l) for l in self.overlay) + 16, line_h * len(self.overlay) + 10)
+            painter.setPen(Qt.PenStyle.NoPen); painter.setBrush(QColor(0, 0, 0, 170))
+            painter.drawRoundedRect(box, 8, 8)
+            painter.setPen(QColor("#9fe8c4"))
+            for i, line in enumerate(self.overlay):
+                painter.drawText(box.left() + 8, box.top() + 5 + fm.ascent() + i * line_h, line)
+
+# FRAME BUFFERS
+class FrameSlot:
+    """A preallocated BGR buffer and the QImage that views it (no copy)."""
+    __slots__ = ('buf', 'image', 'busy')
+
+    def __init__(self, w, h):
+        self.buf = np.empty((h, w, 3), np.uint8)
+        self.image = QImage(self.buf.data, w, h, self.buf.strides[0], QImage.Format.Format_BGR888)
+        self.busy = False
+
+    def release(self):
+        self.busy = False
+
+
+class FramePool:
+    """Per-participant ring of FrameSlots, so preview and decoded frames reach the UI without allocation.
+
+    A slot is busy from `acquire` until the UI drops the frame (replaced on
+    its card, or coalesced before it was drawn), so a buffer is never
+    overwritten while Qt may still read it. When every slot is busy,
+    `acquire` returns None and the caller falls back to a copied QImage.
+    """
+
+    def __init__(self, size=FRAME_POOL_RING):
+        self.size = size
+        self.rings = {}
+        self.lock = threading.Lock()
+        self.misses = 0
+
+    def acquire(self, key, w, h):
+        with self.lock:
+            ring = self.rings.get(key)
+            if ring is None or ring[0].buf.shape[:2] != (h, w):
+                # Ukuran tile berubah: ring lama dibuang, slot yang masih tampil dilepas kartunya sendiri
+                ring = self.rings[key] = [FrameSlot(w, h) for _ in range(self.size)]
+            for slot in ring:
+                if not slot.busy:
+                    slot.busy = True
+                    return slot
+            self.misses += 1
+            return None
+
+# RATE CONTROL
+class RxStats:
+    """One sender's video as this receiver sees it: reassembly plus per-interval feedback deltas."""
+
+    def __init__(self):
+        self.asm = protocol.FrameAssembler()
+        self.bytes = 0
+        self.prev = (0, 0, 0, 0, 0)
+        self.decoder = codec.DeltaDecoder()
+        self.key_req = 0.0
+        self.last_frame = None; self.interval = 0.0; self.jitter = 0.0
+        self.decode_ms = 0.0
+        self.transit = None; self.owd_jitter = 0.0     # dari SEND_TIME (detik), RFC 3550
+        self.last = (0.0, 1.0, 0.0, 0.0, 0)    # laporan interval terakhir, untuk overlay stats
+        self.last_seen = time.monotonic()
+
+    def on_frame(self, now):
+        if self.last_frame is not None:
+            ia = now - self.last_frame
+            self.interval = self.interval * 0.9 + ia * 0.1 if self.interval else ia
+            self.jitter += (abs(ia - self.interval) - self.jitter) / 16
+        self.last_frame = now
+
+    def on_send_time(self, send_us, now):
+        transit = (int(now * 1e6) - send_us) & 0xFFFFFFFF
+        if self.transit is not None:
+            d = protocol.seq_diff32(transit, self.transit) / 1e6
+            self.owd_jitter += (abs(d) - self.owd_jitter) / 16
+        self.transit = transit
+
+    def report(self, dt):
+        a = self.asm
+        cur = (a.fragments, a.expected, a.completed, a.dropped, a.recovered)
+        frags, expected, ok, bad, recovered = [c - p for c, p in zip(cur, self.prev)]
+        self.prev = cur
+        loss = 1 - frags / expected if expected > 0 else 0.0
+        completion = ok / (ok + bad) if ok + bad else 1.0
+        # Variasi delay satu arah bila pengirim memberi SEND_TIME; selain itu jitter antar-kedatangan frame
+        jitter = self.owd_jitter if self.transit is not None else self.jitter
+        out = self.last = (max(0.0, loss), completion, jitter * 1000, self.bytes * 8 / 1000 / dt, recovered)
+        self.bytes = 0
+        return out
+
+    @property
+    def fps(self):
+        return 1 / self.interval if self.interval and time.monotonic() - self.last_frame < 2 else 0.0
+
+class Pacer:
+    """Token bucket for outgoing video; the rate is reset per frame so its packets fill the pacing window."""
+
+    def __init__(self, burst=PACE_BURST):
+        self.burst = burst
+        self.tokens = burst
+        self.rate = 0.0
+        self.last = time.perf_counter()
+        self.waited = 0.0
+
+    def set_window(self, nbytes, seconds):
+        self.rate = nbytes / max(PACE_MIN_WINDOW, seconds)
+
+    def wait(self, size):
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        # Token boleh minus: tidur yang kelamaan (timer OS kasar) terbayar di refill berikutnya
+        self.tokens -= size
+        if self.tokens < 0 and self.rate:
+            d = -self.tokens / self.rate
+            time.sleep(d)
+            self.waited += d
+
+class RateController:
+    """Steps the layer-0 operating point down on congestion and back up after clean intervals."""
+
+    def __init__(self, budget_kbps=TARGET_KBPS):
+        self.level = 0
+        self.budget = budget_kbps
+        self.reports = {}
+        self.good = 0
+        self.sent_bytes = 0
+        self.kbps = 0.0
+        self.loss = 0.0; self.completion = 1.0; self.jitter = 0.0
+        self.recovered = 0
+        self.last = time.monotonic()
+
+    @property
+    def point(self):
+        return RATE_LADDER[self.level]
+
+    @staticmethod
+    def cost(level):
+        w, h, q, fps = RATE_LADDER[level]
+        return w * h * fps * (1 + (q - 50) / 25)
+
+    def on_report(self, reporter, loss, completion, jitter_ms, recovered=0):
+        self.reports[reporter] = (time.monotonic(), loss, completion, jitter_ms, recovered)
+
+    def update(self):
+        now = time.monotonic()
+        dt = max(1e-3, now - self.last)
+        self.kbps = self.sent_bytes * 8 / 1000 / dt
+        self.sent_bytes = 0; self.last = now
+        # Snapshot: thread UDP bisa menambah reporter (on_report) selagi ini berjalan
+        fresh = []
+        for r, v in list(self.reports.items()):
+            if now - v[0] > 3 * FEEDBACK_INTERVAL: self.reports.pop(r, None)
+            else: fresh.append(v)
+        # Penerima terburuk yang menentukan; penerima lemah bisa pindah ke layer simulcast kecil
+        self.loss = max((r[1] for r in fresh), default=0.0)
+        self.completion = min((r[2] for r in fresh), default=1.0)
+        self.jitter = max((r[3] for r in fresh), default=0.0)
+        self.recovered = sum(r[4] for r in fresh)
+
+        step = 0
+        if self.loss > LOSS_SEVERE: step = 2
+        elif (self.loss > LOSS_HIGH or self.completion < COMPLETION_LOW or self.jitter > JITTER_HIGH
+              or self.kbps > self.budget): step = 1
+        if step:
+            self.level = min(len(RATE_LADDER) - 1, self.level + step)
+            self.good = 0
+            return
+        self.good += 1
+        if self.good >= UP_AFTER and self.level > 0:
+            if self.kbps * self.cost(self.level - 1) / self.cost(self.level) <= self.budget:
+                self.level -= 1
+            self.good = 0
+
+    def describe(self):
+        w, h, q, fps = self.point
+        return (f"{h}p · q{q} · {fps}fps · {self.kbps / 1000:.1f} Mbps · loss {self.loss * 100:.0f}%"
+                f" · fec {self.recovered}")
+
+# AUDIO
+class SpeakerBuffer:
+    def __init__(self):
+        self.frames = {}
+        self.next_seq = 0
+        self.playing = False
+        self.target = JITTER_MIN
+        self.jitter = 0.0
+        self.last_seq = None
+        self.last_arrival = 0.0
+        self.last = None
+        self.missing = 0
+        self.late = 0; self.concealed = 0
+        self.cn = 0.0               # amplitudo comfort noise selama pengirim diam
+
+class VoiceActivity:
+    """Energy + zero-crossing VAD with an adaptive noise floor and hangover."""
+
+    def __init__(self):
+        self.floor = None       # dalam -dBov seperti level: besar = sunyi
+        self.hang = 0
+
+    def update(self, samples, level):
+        """Return True while the block should be sent."""
+        if self.floor is None or level > self.floor: self.floor = min(level, VAD_FLOOR_MAX)
+        else: self.floor -= VAD_FLOOR_RISE
+        above = self.floor - level
+        zcr = np.count_nonzero(np.diff(np.signbit(samples))) / max(1, len(samples) - 1)
+        speech = above >= VAD_MARGIN and (zcr < VAD_ZCR_NOISE or above >= 2 * VAD_MARGIN)
+        if speech: self.hang = VAD_HANGOVER
+        elif self.hang: self.hang -= 1
+        return speech or self.hang > 0
+
+class AudioPlayout:
+    """Per-speaker jitter buffers mixed on the sounddevice output callback."""
+
+    def __init__(self):
+        self.speakers = {}
+        self.lock = threading.Lock()
+        self.muted = False
+        self.frame_dur = AUDIO_BLOCK / AUDIO_RATE
+
+    def push(self, username, seq, pcm):
+        frame = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+        now = time.monotonic()
+        with self.lock:
+            sb = self.speakers.get(username)
+            if sb is None: sb = self.speakers[username] = SpeakerBuffer()
+            if sb.playing and protocol.seq_diff(seq, sb.next_seq) < 0:
+                sb.late += 1
+                return
+            # Estimasi jitter gaya RFC 3550 dari selisih waktu tiba vs. selisih seq
+            if sb.last_seq is not None:
+                d = protocol.seq_diff(seq, sb.last_seq)
+                if 0 < d < 100:
+                    dev = abs((now - sb.last_arrival) - d * self.frame_dur)
+                    sb.jitter += (dev - sb.jitter) / 16
+                    sb.target = min(JITTER_MAX, max(JITTER_MIN, 1 + int(3 * sb.jitter / self.frame_dur + 0.5)))
+            if sb.last_seq is None or protocol.seq_diff(seq, sb.last_seq) > 0:
+                sb.last_seq = seq; sb.last_arrival = now
+            if len(sb.frames) < JITTER_MAX * 4: sb.frames[seq] = frame
+
+    def push_cn(self, username, seq, level):
+        now = time.monotonic()
+        with self.lock:
+            sb = self.speakers.get(username)
+            if sb is None: sb = self.speakers[username] = SpeakerBuffer()
+            sb.last_arrival = now
+            sb.last_seq = None      # jeda bicara bukan jitter
+            # Selama masih memutar, penanda diputar berurutan supaya talkspurt tidak terpotong
+            if sb.playing: sb.frames[seq] = level
+            else: sb.cn = 10 ** (-level / 20)
+
+    def comfort(self, sb):
+        if not sb.cn: return None
+        return (np.random.standard_normal(AUDIO_BLOCK) * sb.cn).astype(np.float32)
+
+    def callback(self, outdata, frames, time_info, status):
+        mix = np.zeros(frames, np.float32)
+        now = time.monotonic()
+        with self.lock:
+            for username in list(self.speakers):
+                sb = self.speakers[username]
+                if now - sb.last_arrival > SPEAKER_TIMEOUT:
+                    del self.speakers[username]
+                    continue
+                frame = self.next_frame(sb)
+                if frame is not None and not self.muted:
+                    n = min(frames, len(frame))
+                    mix[:n] += frame[:n]
+        np.clip(mix, -1.0, 1.0, out=outdata[:, 0])
+
+    def next_frame(self, sb):
+        if not sb.playing:
+            if len(sb.frames) < sb.target: return self.comfort(sb)
+            sb.playing = True; sb.cn = 0.0
+            ref = sb.last_seq if sb.last_seq is not None else next(iter(sb.frames))
+            sb.next_seq = min(sb.frames, key=lambda s: protocol.seq_diff(s, ref))
+        frame = sb.frames.pop(sb.next_seq, None)
+        sb.next_seq = (sb.next_seq + 1) & 0xFFFF
+        if isinstance(frame, int):
+            # Penanda comfort noise: talkspurt selesai, isi dengan noise sampai bicara lagi
+            sb.cn = 10 ** (-frame / 20)
+            sb.playing = False; sb.last = None; sb.missing = 0
+            return self.comfort(sb)
+        if frame is None:
+            sb.missing += 1
+            if sb.missing > MAX_CONCEAL or sb.last is None:
+                if not sb.frames: sb.playing = False; sb.last = None
+                return None
+            # Sembunyikan frame hilang: ulangi frame terakhir dengan peredaman
+            sb.concealed += 1
+            sb.last = sb.last * 0.5
+            return sb.last
+        sb.missing = 0
+        sb.last = frame
+        # Buffer kelebihan dibanding target (jitter turun): buang satu frame untuk mengejar latensi
+        if len(sb.frames) > sb.target + 2:
+            sb.frames.pop(sb.next_seq, None)
+            sb.next_seq = (sb.next_seq + 1) & 0xFFFF
+        return frame
+
 # BACKEND
 class BackendWorker(QThread):
-    sig_video = pyqtSignal(str, object, bool, bool, bool)
     sig_chat = pyqtSignal(str, str)
     sig_connected = pyqtSignal()
     sig_disconnected = pyqtSignal()
@@ -226,6 +628,7 @@ class BackendWorker(QThread):
     def __init__(self, username, ip):
         super().__init__()
         self.username = username
+        self.user_b = username.encode('utf-8')
         self.ip = ip
         self.running = True
         self.is_mute = False; self.is_deaf = False; self.is_cam = True
@@ -234,11 +637,50 @@ class BackendWorker(QThread):
         self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536 * 200)
         self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         
-        self.stream_out = sd.OutputStream(channels=1, samplerate=22050)
+        self.playout = AudioPlayout()
+        self.audio_seq = 0
+        self.vad = VoiceActivity()
+        self.audio_silent = False
+        self.last_cn = 0.0
+        self.audio_sent = self.audio_suppressed = 0
+        self.stream_out = sd.OutputStream(channels=1, samplerate=AUDIO_RATE, blocksize=AUDIO_BLOCK,
+                                          dtype='float32', callback=self.playout.callback)
         self.stream_out.start()
-        self.frame_buffer = {} 
         self.frame_seq = 0
 
+        # Pipeline kamera: capture -> pool filter/encode -> sender berurutan
+        self.frame_lock = threading.Lock()
+        self.frame_cond = threading.Condition(self.frame_lock)
+        self.done_cond = threading.Condition(self.frame_lock)
+        self.latest = None
+        self.capture_seq = 0
+        self.last_publish = 0.0
+        self.sent_seq = 0
+        self.in_flight = set()
+        self.encoded = []
+        self.stage_ms = {}
+        self.frames_dropped = 0
+        self.rate = RateController()
+        self.pacer = Pacer()
+        self.pace_deadline = 0.0
+        self.codecs = [codec.DeltaEncoder() for _ in LAYERS]
+        self.rx_stats = {}
+        self.tile_sizes = {}    # username -> (w, h) area gambar di grid, diisi UI
+        # Frame terbaru per peserta yang belum digambar; diambil timer render UI (lihat take_frames)
+        self.render_lock = threading.Lock()
+        self.render_pending = {}
+        self.frames_coalesced = 0
+        self.frame_pool = FramePool()
+        self.speakers = []          # urutan pembicara aktif dari server (SPEAKERS)
+        self.speakers_dirty = False
+        self.pinned = set()
+        self.subs = None            # username -> (layer, fps maks) yang sedang digambar; None = belum berlangganan
+        # Frame lengkap menunggu decode per pengirim; keyframe membuang antrean lama (latest-frame-wins)
+        self.decode_cond = threading.Condition()
+        self.decode_pending = {}
+        self.decode_busy = set()
+        self.frames_skipped = 0
+
         self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
         if not self.cap.isOpened(): self.cap = cv2.VideoCapture(1, cv2.CAP_DSHOW)
         if self.cap.isOpened():
@@ -250,16 +692,28 @@ class BackendWorker(QThread):
         try:
             self.tcp.connect((self.ip, TCP_PORT))
             self.sig_connected.emit()
-            self.send_udp_control({'type': 'hello', 'u': self.username})
+            self.send_udp_control(protocol.HELLO)
             
-            t_cam = threading.Thread(target=self.loop_camera, daemon=True)
-            t_udp = threading.Thread(target=self.loop_udp, daemon=True)
-            t_tcp = threading.Thread(target=self.loop_tcp, daemon=True)
-            t_cam.start(); t_udp.start(); t_tcp.start()
-            
-            while self.running: time.sleep(1)
+            threads = [threading.Thread(target=self.loop_capture, daemon=True),
+                       threading.Thread(target=self.loop_send, daemon=True),
+                       threading.Thread(target=self.loop_udp, daemon=True),
+                       threading.Thread(target=self.loop_tcp, daemon=True)]
+            threads += [threading.Thread(target=self.loop_encode, daemon=True) for _ in range(ENCODE_WORKERS)]
+            threads += [threading.Thread(target=self.loop_decode, daemon=True) for _ in range(DECODE_WORKERS)]
+            for t in threads: t.start()
         except: 
             self.sig_disconnected.emit()
+            return
+
+        # Hanya gagal connect yang berarti putus; error di feedback cukup dilewati sampai interval berikutnya
+        while self.running:
+            time.sleep(FEEDBACK_INTERVAL)
+            try:
+                self.rate.update()
+                self.send_feedback()
+                if self.pinned: self.send_pins()   # server lupa pin kalau peer sempat timeout
+            except Exception as e:
+                print(f"Feedback Error: {e}")
 
     def loop_tcp(self):
         while self.running:
@@ -281,99 +735,323 @@ class BackendWorker(QThread):
                 break
 
     # cam
-    def loop_camera(self):
+    def stage_time(self, name, t0):
+        t = time.perf_counter()
+        dt = (t - t0) * 1000
+        self.stage_ms[name] = self.stage_ms.get(name, dt) * 0.9 + dt * 0.1
+        return t
+
+    def loop_capture(self):
+        # Latest-frame-wins: frame yang belum diambil worker ditimpa frame baru
         while self.running:
             start = time.time()
             frame_ready = False
             if self.is_cam and self.cap.isOpened():
+                t0 = time.perf_counter()
                 ret, frame = self.cap.read()
                 if ret:
                     frame_ready = True
-                    frame = cv2.bilateralFilter(frame, 5, 75, 75)
-                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    qimg = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QImage.Format.Format_RGB888).copy()
-                    self.sig_video.emit(self.username, qimg, self.is_mute, self.is_deaf, False)
-                    _, b = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUAL])
-                    self.send_video_fragments(b.tobytes())
-            
+                    self.stage_time('capture', t0)
+                    # Kamera tetap dibaca penuh supaya buffer driver tidak basi; fps rate control di sini
+                    if start - self.last_publish >= 0.95 / self.rate.point[3]:
+                        self.last_publish = start
+                        with self.frame_lock:
+                            if self.latest is not None: self.frames_dropped += 1
+                            self.capture_seq += 1
+                            self.latest = (self.capture_seq, time.perf_counter(), frame)
+                            self.frame_cond.notify()
+
             if not frame_ready:
-                self.sig_video.emit(self.username, None, self.is_mute, self.is_deaf, True)
-                self.send_udp_control({'type': 'offcam', 'u': self.username, 'mute': self.is_mute, 'deaf': self.is_deaf})
+                self.publish_frame(self.username, None, self.is_mute, self.is_deaf, True)
+                self.send_udp_control(protocol.OFFCAM, bytes((protocol.pack_flags(self.is_mute, self.is_deaf),)))
             time.sleep(max(0, (1.0/FPS) - (time.time()-start)))
 
-    def send_video_fragments(self, data):
-        self.frame_seq = (self.frame_seq + 1) % 256
-        chunks = [data[i:i+MAX_PACKET_SIZE] for i in range(0, len(data), MAX_PACKET_SIZE)]
-        total = len(chunks)
-        user_b = self.username.encode('utf-8')
-        flags = (self.is_mute << 1) | self.is_deaf
-        for i, chunk in enumerate(chunks):
-            header = struct.pack("BBBBB", 0xFF, self.frame_seq, i, total, len(user_b))
-            packet = header + user_b + struct.pack("B", flags) + chunk
+    def loop_encode(self):
+        while self.running:
+            with self.frame_lock:
+                while self.running and self.latest is None: self.frame_cond.wait(0.5)
+                if self.latest is None: continue
+                seq, ts, frame = self.latest
+                self.latest = None
+                self.in_flight.add(seq)
+            preview = None
+            try:
+                t0 = time.perf_counter()
+                frame = cv2.bilateralFilter(frame, 5, 75, 75)
+                preview = self.to_qimage(self.username, frame)
+                t1 = self.stage_time('filter', t0)
+                encoded = self.encode_layers(frame)
+                self.stage_time('encode', t1)
+            except Exception:
+                if preview is not None and preview[1] is not None: preview[1].release()
+                preview = encoded = None
+            with self.frame_lock:
+                self.in_flight.discard(seq)
+                if encoded is not None: heapq.heappush(self.encoded, (seq, ts, preview, encoded))
+                self.done_cond.notify()
+
+    def encode_layers(self, frame):
+        out = []
+        for layer in range(min(SIMULCAST_LAYERS, len(LAYERS))):
+            w, h, qual = LAYERS[layer] if layer else self.rate.point[:3]
+            src = frame if frame.shape[1] <= w else cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+            if DELTA_CODEC:
+                out.append((layer, src, qual))   # delta butuh urutan frame -> dikodekan di loop_send
+                continue
+            _, b = cv2.imencode('.jpg', src, [int(cv2.IMWRITE_JPEG_QUALITY), qual])
+            out.append((layer, b.tobytes(), qual))
+        return out
+
+    def ready_to_send(self):
+        # Kirim sesuai urutan capture: tunggu selama masih ada frame lebih tua yang sedang diproses
+        return self.encoded and (not self.in_flight or self.encoded[0][0] < min(self.in_flight))
+
+    def loop_send(self):
+        while self.running:
+            with self.frame_lock:
+                while self.running and not self.ready_to_send(): self.done_cond.wait(0.5)
+                if not self.ready_to_send(): continue
+                seq, ts, preview, encoded = heapq.heappop(self.encoded)
+            if seq <= self.sent_seq:
+                self.frames_dropped += 1
+                if preview[1] is not None: preview[1].release()
+                continue
+            self.sent_seq = seq
+            t0 = time.perf_counter()
+            self.pace_deadline = t0 + PACE_SPREAD / self.rate.point[3]
+            self.publish_frame(self.username, preview[0], self.is_mute, self.is_deaf, False, preview[1])
+            self.frame_seq = (self.frame_seq + 1) & 0xFFFFFFFF
+            if DELTA_CODEC:
+                for layer, src, qual in encoded:
+                    b, delta = self.codecs[layer].encode(src, qual, self.frame_seq)
+                    self.send_video_fragments(b, layer, delta)
+            else:
+                for layer, b, _ in encoded: self.send_video_fragments(b, layer)
+            self.stage_time('send', t0)
+            self.stage_time('latency', ts)
+
+    def send_video_fragments(self, data, layer=0, delta=False):
+        total, size = protocol.split_frame(len(data), MAX_PACKET_SIZE)
+        groups = protocol.fec_groups(total, FEC_RATIO)
+        flags = protocol.pack_flags(self.is_mute, self.is_deaf, layer, delta)
+        view = memoryview(data)
+        payloads = [view[i*size:(i+1)*size] for i in range(total)]
+        if groups: payloads += protocol.xor_parity(view, total, size, groups)
+        # Sisa jendela frame ini dibagi rata ke semua fragmen (layer berikutnya memakai sisanya)
+        wire = size + protocol.VIDEO_HEADER.size + len(self.user_b) + 1 + protocol.SEND_TIME.size
+        if PACING: self.pacer.set_window(len(payloads) * wire, self.pace_deadline - time.perf_counter())
+        for i, payload in enumerate(payloads):
+            if PACING: self.pacer.wait(wire)
+            packet = protocol.pack_video_header(self.frame_seq, len(data), i, total, groups, self.user_b, flags,
+                                                time.monotonic() if SEND_TIMESTAMPS else None) + payload
             try: self.udp.sendto(packet, (self.ip, UDP_PORT))
             except: pass
+        if layer == 0: self.rate.sent_bytes += len(data)
 
-    def send_udp_control(self, data):
-        try: self.udp.sendto(pickle.dumps(data, 5), (self.ip, UDP_PORT))
+    def send_udp_control(self, kind, body=b''):
+        try: self.udp.sendto(protocol.pack_ctrl(kind, self.user_b, body), (self.ip, UDP_PORT))
         except: pass
 
+    def subscribe(self, subs):
+        self.subs = subs
+        self.send_udp_control(protocol.SUBSCRIBE, protocol.pack_subscriptions({u.encode('utf-8'): v for u, v in subs.items()}))
+
+    def send_pins(self):
+        self.send_udp_control(protocol.PIN, protocol.pack_names([u.encode('utf-8') for u in list(self.pinned)]))
+
+    def send_feedback(self):
+        now = time.monotonic()
+        per_user = {}
+        for key, st in list(self.rx_stats.items()):
+            if now - st.last_seen > 5: del self.rx_stats[key]
+            else: per_user.setdefault(key[0], []).append(st.report(FEEDBACK_INTERVAL))
+        for username, reports in per_user.items():
+            # Pengirim yang dibatasi langganan (thumbnail / fps maks) kehilangan frame dengan sengaja
+            if self.subs is not None and self.subs.get(username, (0, 1))[1]: continue
+            loss = max(r[0] for r in reports); completion = min(r[1] for r in reports)
+            jitter = max(r[2] for r in reports); kbps = sum(r[3] for r in reports)
+            recovered = sum(r[4] for r in reports)
+            self.send_udp_control(protocol.FEEDBACK, protocol.pack_feedback(username.encode('utf-8'), loss, completion, jitter, kbps, recovered))
+
     def loop_udp(self):
         while self.running:
             try:
                 data, _ = self.udp.recvfrom(65536)
-                if data[0] == 0xFF: self.process_fragment(data)
-                else: 
-                    obj = pickle.loads(data)
-                    self.process_control(obj)
+                if data[0] == protocol.VIDEO: self.process_fragment(data)
+                else:
+                    msg = protocol.unpack_ctrl(data)
+                    if msg: self.process_control(*msg)
             except: pass
 
     def process_fragment(self, data):
         try:
-            seq, idx, total, u_len = struct.unpack("BBBB", data[1:5])
-            username = data[5:5+u_len].decode('utf-8')
-            flags = data[5+u_len]
-            chunk = data[6+u_len:]
-            is_mute = bool(flags & 2); is_deaf = bool(flags & 1)
-
-            if username not in self.frame_buffer: self.frame_buffer[username] = {}
-            user_buf = self.frame_buffer[username]
-            
-            if seq not in user_buf:
-                user_buf.clear()
-                user_buf[seq] = {'chunks': {}, 'total': total, 'ts': time.time()}
-            
-            frame_data = user_buf[seq]
-            frame_data['chunks'][idx] = chunk
-            
-            if len(frame_data['chunks']) == total:
-                sorted_chunks = sorted(frame_data['chunks'].items())
-                full_data = b''.join([c[1] for c in sorted_chunks])
-                frame_arr = np.frombuffer(full_data, np.uint8)
-                f = cv2.imdecode(frame_arr, cv2.IMREAD_COLOR)
-                if f is not None:
-                    rgb = cv2.cvtColor(f, cv2.COLOR_BGR2RGB)
-                    qimg = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QImage.Format.Format_RGB888).copy()
-                    self.sig_video.emit(username, qimg, is_mute, is_deaf, False)
-                del user_buf[seq]
+            head = protocol.parse_video(data)
+            if head is None: return
+            seq, frame_len, idx, total, parity, username, flags, off = head
+            key = (username, (flags >> 2) & 3)
+
+            st = self.rx_stats.get(key)
+            if st is None: st = self.rx_stats[key] = RxStats()
+            now = time.monotonic()
+            st.bytes += len(data); st.last_seen = now
+            cached = flags & protocol.FLAG_CACHED
+            if flags & protocol.FLAG_TIMESTAMP and not cached: st.on_send_time(protocol.send_time(data, off), now)
+
+            full_data = st.asm.add(seq, frame_len, idx, total, parity, memoryview(data)[off:], now)
+            if full_data is None: return
+            # Frame dari cache server (baru join): jarak seq ke frame live berikutnya bukan frame yang hilang
+            if cached: st.asm.last_done = None
+            st.on_frame(now)
+            self.queue_decode(key, st, seq, full_data, flags)
         except: pass
 
-    def process_control(self, obj):
-        ptype = obj.get('type')
-        if ptype == 'audio' and not self.is_deaf:
-            raw = np.frombuffer(obj['d'], dtype=np.int16)
-            self.stream_out.write(raw.astype(np.float32)/32767)
-        elif ptype == 'offcam':
-            self.sig_video.emit(obj['u'], None, obj['mute'], obj['deaf'], True)
+    def queue_decode(self, key, st, seq, data, flags):
+        # Buffer frame sudah dilepas assembler, jadi boleh diserahkan ke thread lain tanpa copy
+        with self.decode_cond:
+            pending = self.decode_pending.get(key)
+            if pending is None or not flags & protocol.FLAG_DELTA:
+                # Frame independen: semua yang belum di-decode sudah basi. Delta tidak boleh dilewati.
+                if pending: self.frames_skipped += len(pending[1])
+                pending = self.decode_pending[key] = (st, [])
+            pending[1].append((seq, data, flags))
+            self.decode_cond.notify()
+
+    def loop_decode(self):
+        while self.running:
+            with self.decode_cond:
+                key = next((k for k in self.decode_pending if k not in self.decode_busy), None)
+                if key is None:
+                    self.decode_cond.wait(0.5)
+                    continue
+                st, batch = self.decode_pending.pop(key)
+                self.decode_busy.add(key)
+            try: self.decode_frames(key, st, batch)
+            except: pass
+            with self.decode_cond:
+                self.decode_busy.discard(key)
+                if key in self.decode_pending: self.decode_cond.notify()
+
+    def decode_frames(self, key, st, batch):
+        t0 = time.perf_counter()
+        st.decoder.target = self.tile_sizes.get(key[0])
+        f = None
+        for seq, data, flags in batch:
+            f = st.decoder.decode(data, seq, flags & protocol.FLAG_DELTA)
+            if f is None: break
+        if f is None:
+            # Rantai delta putus (frame hilang / baru join / ganti layer): minta keyframe
+            if flags & protocol.FLAG_DELTA: self.request_keyframe(key, st)
+            return
+        if st.decoder.wants_keyframe(): self.request_keyframe(key, st)   # tile membesar: perlu resolusi penuh
+        # Hanya frame terbaru yang ditampilkan, ditulis langsung seukuran tile ke buffer pool.
+        # Frame decoder dipakai ulang untuk delta berikutnya, jadi tetap perlu satu salinan/resize.
+        qimg, slot = self.to_qimage(key[0], f)
+        self.publish_frame(key[0], qimg, bool(flags & protocol.FLAG_MUTE), bool(flags & protocol.FLAG_DEAF), False, slot)
+        t = self.stage_time('decode', t0)
+        st.decode_ms += ((t - t0) * 1000 - st.decode_ms) * 0.1
+
+    def publish_frame(self, username, qimg, mute, deaf, off, slot=None):
+        with self.render_lock:
+            old = self.render_pending.get(username)
+            if old is not None:
+                self.frames_coalesced += 1
+                if old[4] is not None: old[4].release()   # tidak pernah digambar
+            self.render_pending[username] = (qimg, mute, deaf, off, slot)
+
+    def take_frames(self):
+        with self.render_lock:
+            pending, self.render_pending = self.render_pending, {}
+        return pending
+
+    def to_qimage(self, username, f):
+        """Return (QImage, FrameSlot or None) of BGR frame `f`, downscaled to the tile of `username`."""
+        w, h = f.shape[1], f.shape[0]
+        size = self.tile_sizes.get(username)
+        if size:
+            tw, th = fit_size(w, h, *size)
+            if tw < w: w, h = tw, th
+        slot = self.frame_pool.acquire(username, w, h)
+        if slot is None:
+            img = cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA) if w < f.shape[1] else f
+            return QImage(img.data, w, h, img.strides[0], QImage.Format.Format_BGR888).copy(), None
+        if w < f.shape[1]: cv2.resize(f, (w, h), dst=slot.buf, interpolation=cv2.INTER_AREA)
+        else: np.copyto(slot.buf, f)
+        return slot.image, slot
+
+    def metrics_lines(self, username):
+        """Overlay text for one card: pipeline timings for self, receive quality for others."""
+        if username == self.username:
+            ms = self.stage_ms
+            w, h, q, fps = self.rate.point
+            return [f"capture {ms.get('capture', 0):5.1f} ms  filter {ms.get('filter', 0):5.1f} ms",
+                    f"encode  {ms.get('encode', 0):5.1f} ms  send   {ms.get('send', 0):5.1f} ms",
+                    f"latency {ms.get('latency', 0):5.1f} ms  dropped {self.frames_dropped}  pool miss {self.frame_pool.misses}",
+                    f"tx {h}p q{q} {fps}fps {self.rate.kbps:.0f} kbps",
+                    f"audio sent {self.audio_sent} vad-off {self.audio_suppressed}"]
+        st = max(((k, v) for k, v in list(self.rx_stats.items()) if k[0] == username),
+                 key=lambda kv: kv[1].last_seen, default=None)
+        if st is None: return ["no video"]
+        (_, layer), st = st
+        loss, completion, jitter, kbps, recovered = st.last
+        w, h = st.decoder.size or (0, 0)
+        sub = self.subs.get(username) if self.subs is not None else (layer, 0)
+        mode = "thumbnail" if sub is None else f"max {sub[1]} fps" if sub[1] else "full"
+        return [f"rx {st.fps:4.1f} fps  decode {st.decode_ms:5.1f} ms",
+                f"loss {loss * 100:4.1f}%  frames ok {completion * 100:3.0f}%",
+                f"jitter {jitter:4.1f} ms  fec {recovered}",
+                f"{kbps:.0f} kbps  layer {layer} {w}x{h} /{st.decoder.scale}",
+                f"sub {mode}"]
+
+    def request_keyframe(self, key, st):
+        now = time.monotonic()
+        if now - st.key_req > KEYFRAME_REQ_INTERVAL:
+            st.key_req = now
+            self.send_udp_control(protocol.KEYFRAME, protocol.pack_keyframe_request(key[0].encode('utf-8'), key[1]))
+
+    def process_control(self, kind, username, body):
+        if kind == protocol.AUDIO and not self.is_deaf:
+            seq, level, pcm = protocol.unpack_audio(body)
+            self.playout.push(username, seq, pcm)
+        elif kind == protocol.COMFORT_NOISE and len(body) >= protocol.AUDIO_HEADER.size and not self.is_deaf:
+            seq, level, _ = protocol.unpack_audio(body)
+            self.playout.push_cn(username, seq, level)
+        elif kind == protocol.FEEDBACK:
+            target, loss, completion, jitter_ms, kbps, recovered = protocol.unpack_feedback(body)
+            if target == self.username: self.rate.on_report(username, loss, completion, jitter_ms, recovered)
+        elif kind == protocol.SPEAKERS:
+            self.speakers = [n.decode('utf-8', 'replace') for n in protocol.unpack_names(body)]
+            self.speakers_dirty = True
+        elif kind == protocol.KEYFRAME and len(body):
+            target, layer = protocol.unpack_keyframe_request(body)
+            if target == self.username and layer < len(self.codecs): self.codecs[layer].request_keyframe()
+        elif kind == protocol.OFFCAM and len(body):
+            flags = body[0]
+            self.publish_frame(username, None, bool(flags & protocol.FLAG_MUTE), bool(flags & protocol.FLAG_DEAF), True)
 
-    def audio_callback(self, indata, frames, time, status):
+    def audio_callback(self, indata, frames, time_info, status):
         if self.running and not self.is_mute and not self.is_deaf:
+            level = audio_level(indata)
+            if VAD_ENABLED and not self.vad.update(indata[:, 0], level):
+                # Diam: kirim penanda comfort noise di awal jeda lalu tiap CN_INTERVAL saja
+                self.audio_suppressed += 1
+                now = time.monotonic()
+                if self.audio_silent and now - self.last_cn < CN_INTERVAL: return
+                self.audio_silent = True; self.last_cn = now
+                self.audio_seq = (self.audio_seq + 1) & 0xFFFF
+                self.send_udp_control(protocol.COMFORT_NOISE, protocol.pack_audio(self.audio_seq, b'', level))
+                return
+            self.audio_silent = False
+            self.audio_sent += 1
             packed = (indata * 32767).astype(np.int16).tobytes()
-            self.send_udp_control({'type': 'audio', 'u': self.username, 'd': packed})
+            self.audio_seq = (self.audio_seq + 1) & 0xFFFF
+            self.send_udp_control(protocol.AUDIO, protocol.pack_audio(self.audio_seq, packed, level))
 
     def stop(self):
         self.running = False
         try: self.cap.release()
         except: pass
+        try: self.stream_out.stop()
+        except: pass
         try: self.udp.close()
         except: pass
         try: self.tcp.close()
@@ -389,18 +1067,39 @@ class MainWindow(QMainWindow):
         self.setWindowIcon(create_locus_icon())
         
         self.backend = BackendWorker(username, ip)
-        self.backend.sig_video.connect(self.update_grid)
         self.backend.sig_chat.connect(self.update_chat)
         self.backend.sig_disconnected.connect(self.on_server_down)
         
         self.cards = {} 
+        self.show_stats = False
+        self.grid_cols = 0
+        self.grid_order = []
         self.setup_ui()
         self.toast = ToastOverlay(self)
         
-        self.stream_in = sd.InputStream(callback=self.backend.audio_callback, channels=1, samplerate=22050)
+        self.stream_in = sd.InputStream(callback=self.backend.audio_callback, channels=1,
+                                        samplerate=AUDIO_RATE, blocksize=AUDIO_BLOCK)
         self.stream_in.start()
         self.backend.start()
 
+        self.layer_timer = QTimer(self)
+        self.layer_timer.timeout.connect(self.update_subscriptions)
+        self.layer_timer.timeout.connect(self.update_tile_sizes)
+        self.layer_timer.start(LAYER_REQ_INTERVAL)
+
+        # Satu timer render seirama layar: frame yang datang di antara dua tick digabung
+        screen = QApplication.primaryScreen()
+        hz = min(MAX_RENDER_HZ, screen.refreshRate() if screen and screen.refreshRate() > 0 else MAX_RENDER_HZ)
+        self.render_timer = QTimer(self)
+        self.render_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.render_timer.timeout.connect(self.render_frames)
+        self.render_timer.start(int(1000 / hz))
+
+        self.rate_timer = QTimer(self)
+        self.rate_timer.timeout.connect(self.update_rate_label)
+        self.rate_timer.timeout.connect(self.update_overlays)
+        self.rate_timer.start(int(FEEDBACK_INTERVAL * 1000))
+
     def setup_ui(self):
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -420,6 +1119,9 @@ class MainWindow(QMainWindow):
         h_layout.addWidget(logo_lbl)
         h_layout.addWidget(title)
         h_layout.addStretch()
+        self.lbl_rate = QLabel()
+        self.lbl_rate.setStyleSheet("color: #888; font-size: 12px; margin-right: 10px;")
+        h_layout.addWidget(self.lbl_rate)
         main_layout.addWidget(header)
 
         # CONTENT
@@ -475,18 +1177,21 @@ class MainWindow(QMainWindow):
         self.btn_deaf = self.create_btn("Deafen", "#2cc985", "🎧")
         self.btn_cam = self.create_btn("Camera", "#2cc985", "📷")
         self.btn_chat = self.create_btn("Chat", "#555", "💬")
+        self.btn_stats = self.create_btn("Stats", "#555", "📊")
         self.btn_leave = self.create_btn("Leave", "#ff4444", "🚪")
 
         self.btn_mute.clicked.connect(self.action_mute)
         self.btn_deaf.clicked.connect(self.action_deaf)
         self.btn_cam.clicked.connect(self.action_cam)
         self.btn_chat.clicked.connect(self.action_toggle_chat)
+        self.btn_stats.clicked.connect(self.action_stats)
         self.btn_leave.clicked.connect(self.close)
 
         b_layout.addWidget(self.btn_mute)
         b_layout.addWidget(self.btn_deaf)
         b_layout.addWidget(self.btn_cam)
         b_layout.addWidget(self.btn_chat) 
+        b_layout.addWidget(self.btn_stats)
         b_layout.addWidget(self.btn_leave)
         b_layout.addStretch()
         main_layout.addWidget(bottom)
@@ -518,6 +1223,16 @@ class MainWindow(QMainWindow):
         c = "#555" if is_open else "#3a7ebf"
         self.btn_chat.setStyleSheet(f"background-color: {c}; text-align: left; padding-left: 15px;")
 
+    def action_stats(self):
+        self.show_stats = not self.show_stats
+        c = "#3a7ebf" if self.show_stats else "#555"
+        self.btn_stats.setStyleSheet(f"background-color: {c}; text-align: left; padding-left: 15px;")
+        self.update_overlays()
+
+    def update_overlays(self):
+        for u, card in self.cards.items():
+            card.set_overlay(self.backend.metrics_lines(u) if self.show_stats else None)
+
     def action_send_chat(self):
         text = self.chat_input.text()
         if text:
@@ -547,6 +1262,7 @@ class MainWindow(QMainWindow):
             self.backend.is_mute = False 
             msg = "Undeafened"
             icon = "🎧"
+        self.backend.playout.muted = self.backend.is_deaf
         self.update_audio_ui()
         self.toast.show_message(msg, icon)
 
@@ -569,21 +1285,83 @@ class MainWindow(QMainWindow):
         self.btn_cam.setIcon(create_button_icon("📷", crossed_out=not self.backend.is_cam))
         self.toast.show_message("Camera ON" if self.backend.is_cam else "Camera OFF")
 
-    def update_grid(self, username, qimg, mute, deaf, off):
+    def render_frames(self):
+        for username, (qimg, mute, deaf, off, slot) in self.backend.take_frames().items():
+            self.update_grid(username, qimg, mute, deaf, off, slot)
+        if self.backend.speakers_dirty:
+            self.backend.speakers_dirty = False
+            self.layout_grid()
+
+    def update_grid(self, username, qimg, mute, deaf, off, slot=None):
         if username not in self.cards:
             card = VideoCard(username)
+            card.sig_pin.connect(self.toggle_pin)
             self.cards[username] = card
             count = len(self.cards)
             cols = int(count**0.5) + 1 if count > 1 else 1
-            for i, (u, w) in enumerate(self.cards.items()):
-                self.grid_layout.addWidget(w, i // cols, i % cols)
-        self.cards[username].update_data(qimg, mute, deaf, off)
+            if cols == self.grid_cols:
+                self.grid_layout.addWidget(card, (count - 1) // cols, (count - 1) % cols)
+                self.grid_order.append(username)
+            else:
+                self.layout_grid()   # jumlah kolom berubah: baru di sini kartu lama dipindah
+            QTimer.singleShot(0, self.update_subscriptions)   # tile baru: langsung langganan bila terlihat
+        self.cards[username].update_data(qimg, mute, deaf, off, slot)
+
+    def layout_grid(self):
+        # Diri sendiri dulu, lalu yang di-pin, lalu urutan pembicara dari server, sisanya urutan join
+        me = self.backend.username
+        rank = {u: i for i, u in enumerate(self.backend.speakers)}
+        others = sorted((u for u in self.cards if u != me),
+                        key=lambda u: (u not in self.backend.pinned, rank.get(u, len(rank))))
+        order = ([me] if me in self.cards else []) + others
+        if order == self.grid_order: return
+        count = len(order)
+        cols = int(count**0.5) + 1 if count > 1 else 1
+        for u in order: self.grid_layout.removeWidget(self.cards[u])
+        for i, u in enumerate(order): self.grid_layout.addWidget(self.cards[u], i // cols, i % cols)
+        self.grid_order = order
+        self.grid_cols = cols
+
+    def toggle_pin(self, username):
+        if username == self.backend.username: return
+        pinned = self.backend.pinned
+        if username in pinned: pinned.discard(username)
+        else: pinned.add(username)
+        card = self.cards[username]
+        card.pinned = username in pinned
+        card.update()
+        self.backend.send_pins()
+        self.layout_grid()
+        self.toast.show_message(f"Pinned {username}" if card.pinned else f"Unpinned {username}", "📌")
+
+    def update_subscriptions(self):
+        # Hanya tile yang terlihat di area scroll yang berlangganan; sisanya dikirim server sebagai thumbnail.
+        # Per tile: layer terkecil yang masih setinggi tile itu; server memilih layer terdekat yang tersedia.
+        subs = {}
+        if not self.isMinimized():
+            for u, c in self.cards.items():
+                if u == self.backend.username or c.visibleRegion().isEmpty(): continue
+                tile_h = c.draw_size()[1]   # device pixel, sama dengan ukuran decode
+                layer = 0
+                for i, (w, h, q) in enumerate(LAYERS):
+                    if h >= tile_h: layer = i
+                subs[u] = (layer, SMALL_TILE_FPS if tile_h < SMALL_TILE_H else 0)
+        self.backend.subscribe(subs)
+
+    def update_tile_sizes(self):
+        self.backend.tile_sizes = {u: c.draw_size() for u, c in self.cards.items()}
+
+    def update_rate_label(self):
+        self.lbl_rate.setText(self.backend.rate.describe() if self.backend.is_cam else "")
 
     def update_chat(self, user, msg):
         c = "#3a7ebf" if user == "Me" else "#2cc985"
         self.chat_area.append(f"<b style='color:{c}'>{user}:</b> {msg}")
 
     def closeEvent(self, event):
+        self.layer_timer.stop()
+        self.render_timer.stop()
+        self.rate_timer.stop()
         self.backend.stop()
         self.stream_in.stop()
         event.accept()
@@ -0,0 +1,151 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# Delta codec: keyframe = JPEG biasa; delta = hanya tile yang berubah, disusun jadi satu
+# mosaic JPEG lalu ditempel penerima ke frame terakhirnya. Satu JPEG per frame delta
+# (bukan per tile) karena header JPEG ~600 byte lebih besar dari isi tile 32x32.
+TILE = 32                   # kelipatan blok DCT 8x8 sehingga artefak tidak menyeberang tile
+TILE_THRESHOLD = 6.0        # rata-rata selisih absolut per piksel supaya tile dianggap berubah
+KEYFRAME_INTERVAL = 2.0
+KEYFRAME_MIN_GAP = 0.25     # permintaan keyframe dari banyak penerima digabung
+MAX_DELTA_FRACTION = 0.5    # lebih banyak tile berubah dari ini -> kirim keyframe saja
+MOSAIC_COLS = 32
+
+# Payload delta: ref seq, lebar, tinggi, ukuran tile, jumlah tile | (tx, ty) per tile | mosaic JPEG
+DELTA_HEADER = struct.Struct("!IHHBH")
+TILE_POS = struct.Struct("!BB")
+# Decode JPEG langsung di 1/2, 1/4, 1/8 resolusi (skala DCT libjpeg, jauh lebih murah dari decode penuh + resize)
+READ_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+              8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def pick_scale(size, target):
+    """Largest reduced-decode factor whose output still covers target (w, h); 1 if either is unknown."""
+    if size and target:
+        for s in (8, 4, 2):
+            if size[0] // s >= target[0] and size[1] // s >= target[1]: return s
+    return 1
+
+
+def changed_tiles(img, ref, tile=TILE, threshold=TILE_THRESHOLD):
+    """Return (ty, tx) arrays of tiles whose mean absolute difference exceeds threshold."""
+    d = cv2.absdiff(img, ref)
+    h, w = d.shape[:2]
+    ch = d.shape[2] if d.ndim == 3 else 1
+    # Kanal dijumlahkan lewat view 2D (h, w*ch): jauh lebih cepat dari max/sum pada axis kanal
+    d = d.reshape(h, w * ch)
+    rows = np.arange(0, h, tile)
+    cols = np.arange(0, w, tile)
+    sums = np.add.reduceat(np.add.reduceat(d, cols * ch, axis=1, dtype=np.uint32), rows, axis=0)
+    areas = np.outer(np.minimum(tile, h - rows), np.minimum(tile, w - cols) * ch)
+    return np.nonzero(sums > areas * threshold)
+
+
+class DeltaEncoder:
+    """Sender side of the delta codec for one stream (one simulcast layer)."""
+
+    def __init__(self, tile=TILE, keyframe_interval=KEYFRAME_INTERVAL):
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.ref = None
+        self.ref_seq = 0
+        self.last_key = float('-inf')
+        self.force_key = False
+        self.keyframes = self.deltas = 0
+
+    def encode(self, img, quality, seq, now=None):
+        """Return (payload, is_delta) for frame `seq`."""
+        if now is None: now = time.monotonic()
+        if (self.ref is None or self.ref.shape != img.shape or now - self.last_key > self.keyframe_interval
+                or (self.force_key and now - self.last_key >= KEYFRAME_MIN_GAP)):
+            return self.keyframe(img, quality, seq, now)
+        ys, xs = changed_tiles(img, self.ref, self.tile)
+        count = len(ys)
+        tiles_total = -(-img.shape[0] // self.tile) * -(-img.shape[1] // self.tile)
+        if count > tiles_total * MAX_DELTA_FRACTION:
+            return self.keyframe(img, quality, seq, now)
+
+        t = self.tile
+        h, w = img.shape[:2]
+        header = DELTA_HEADER.pack(self.ref_seq, w, h, t, count)
+        if count:
+            cols = min(count, MOSAIC_COLS)
+            mosaic = np.zeros((-(-count // cols) * t, cols * t) + img.shape[2:], img.dtype)
+            for k, (ty, tx) in enumerate(zip(ys.tolist(), xs.tolist())):
+                y, x = ty * t, tx * t
+                block = img[y:y + t, x:x + t]
+                my, mx = (k // cols) * t, (k % cols) * t
+                mosaic[my:my + block.shape[0], mx:mx + block.shape[1]] = block
+                self.ref[y:y + t, x:x + t] = block
+            _, jpg = cv2.imencode('.jpg', mosaic, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            payload = header + b''.join(TILE_POS.pack(tx, ty) for ty, tx in zip(ys.tolist(), xs.tolist())) + jpg.tobytes()
+        else:
+            payload = header
+        self.ref_seq = seq
+        self.deltas += 1
+        return payload, True
+
+    def request_keyframe(self):
+        self.force_key = True
+
+    def keyframe(self, img, quality, seq, now):
+        _, jpg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        self.ref = img.copy()
+        self.ref_seq = seq
+        self.last_key = now
+        self.force_key = False
+        self.keyframes += 1
+        return jpg.tobytes(), False
+
+
+class DeltaDecoder:
+    """Receiver side: keeps the last reconstructed frame and patches delta tiles into it.
+
+    Set `target` to the (w, h) actually displayed; keyframes are then decoded
+    at the smallest DCT scale that still covers it and following deltas are
+    patched at that scale.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.seq = None
+        self.size = None        # ukuran penuh frame pengirim
+        self.target = None
+        self.scale = 1
+
+    def decode(self, data, seq, is_delta):
+        """Return the reconstructed BGR frame, or None if the delta chain is broken."""
+        buf = np.frombuffer(data, np.uint8)
+        if not is_delta:
+            scale = pick_scale(self.size, self.target)
+            f = cv2.imdecode(buf, READ_FLAGS[scale])
+            if f is not None:
+                self.frame = f; self.seq = seq; self.scale = scale
+                if scale == 1 or self.size is None: self.size = (f.shape[1] * scale, f.shape[0] * scale)
+            return f
+        if len(data) < DELTA_HEADER.size: return None
+        ref, w, h, t, count = DELTA_HEADER.unpack_from(data)
+        s = self.scale
+        if self.frame is None or self.seq != ref or self.frame.shape[:2] != (-(-h // s), -(-w // s)): return None
+        self.size = (w, h)
+        if count:
+            pos_end = DELTA_HEADER.size + count * TILE_POS.size
+            mosaic = cv2.imdecode(buf[pos_end:], READ_FLAGS[s])
+            if mosaic is None: return None
+            cols = min(count, MOSAIC_COLS)
+            t //= s
+            for k in range(count):
+                tx, ty = TILE_POS.unpack_from(data, DELTA_HEADER.size + k * TILE_POS.size)
+                y, x = ty * t, tx * t
+                dst = self.frame[y:y + t, x:x + t]
+                my, mx = (k // cols) * t, (k % cols) * t
+                dst[:] = mosaic[my:my + dst.shape[0], mx:mx + dst.shape[1]]
+        self.seq = seq
+        return self.frame
+
+    def wants_keyframe(self):
+        """True when the display grew beyond what the current decode scale can show."""
+        return self.frame is not None and pick_scale(self.size, self.target) < self.scale
@@ -0,0 +1,315 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import protocol
+import server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Peserta sintetis: bicara wire format yang sama dengan client.py (fragmen video + FEC,
+# AUDIO, HELLO, chat TCP) tanpa kamera/Qt. Timestamp kirim ditanam di awal chunk 0 frame
+# dan di awal PCM audio supaya penerima bisa menghitung latensi end-to-end.
+STAMP = struct.Struct("!d")
+KEEPALIVE = 1.0         # HELLO berkala supaya penerima murni tidak di-timeout server
+WARMUP = 2.5            # tunggu registry server (dan antar worker) melihat semua peserta
+DRAIN = 0.5             # tetap menerima setelah pengirim berhenti
+MAX_SAMPLES = 20000     # sampel latensi per proses (reservoir)
+AUDIO_BYTES = 441 * 2   # 20 ms @ 22050 Hz int16, sama dengan client
+
+
+class Samples:
+    def __init__(self):
+        self.values = []
+        self.seen = 0
+
+    def add(self, v):
+        self.seen += 1
+        if len(self.values) < MAX_SAMPLES: self.values.append(v)
+        else:
+            i = random.randrange(self.seen)
+            if i < MAX_SAMPLES: self.values[i] = v
+
+
+class Participant:
+    def __init__(self, idx, host, args, sends_video):
+        self.name = f"load{idx:04d}".encode()
+        self.dest = (host, server.UDP_PORT)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        self.udp.setblocking(False)
+        self.sends_video = sends_video
+        self.frame_bytes = max(STAMP.size, int(args.video_kbps * 1000 / 8 / args.fps))
+        self.frame_seq = 0
+        self.audio_seq = 0
+        self.chat = None
+        self.chat_in = bytearray()
+        self.next_frame = self.next_audio = self.next_chat = self.next_hello = 0.0
+
+    def send(self, data, stats):
+        try:
+            self.udp.sendto(data, self.dest)
+            stats['sent_packets'] += 1
+        except OSError:
+            stats['send_errors'] += 1
+
+    def send_frame(self, now, fec, stats):
+        data = bytearray(self.frame_bytes)
+        STAMP.pack_into(data, 0, now)
+        self.frame_seq = (self.frame_seq + 1) & 0xFFFFFFFF
+        total, size = protocol.split_frame(len(data), 1200)
+        groups = protocol.fec_groups(total, fec)
+        view = memoryview(data)
+        payloads = [view[i * size:(i + 1) * size] for i in range(total)]
+        if groups: payloads += protocol.xor_parity(view, total, size, groups)
+        for i, payload in enumerate(payloads):
+            self.send(protocol.pack_video_header(self.frame_seq, len(data), i, total, groups, self.name, 0) + payload, stats)
+        stats['sent_fragments'] += len(payloads)
+
+    def send_audio(self, now, stats):
+        self.audio_seq = (self.audio_seq + 1) & 0xFFFF
+        pcm = STAMP.pack(now) + bytes(AUDIO_BYTES - STAMP.size)
+        self.send(protocol.pack_ctrl(protocol.AUDIO, self.name, protocol.pack_audio(self.audio_seq, pcm, 30)), stats)
+        stats['sent_audio'] += 1
+
+    def send_chat(self, now, stats):
+        d = pickle.dumps({'u': self.name.decode(), 't': f"{now!r}"})
+        try:
+            self.chat.send(len(d).to_bytes(4, 'big') + d)
+            stats['sent_chat'] += 1
+        except OSError:
+            stats['send_errors'] += 1
+
+
+def on_udp(data, now, stats, lat):
+    stats['recv_packets'] += 1
+    stats['recv_bytes'] += len(data)
+    if data[0] == protocol.VIDEO:
+        head = protocol.parse_video(data)
+        if head is None: return
+        stats['recv_fragments'] += 1
+        if head[2] == 0: lat['video'].add(now - STAMP.unpack_from(data, head[7])[0])
+        return
+    msg = protocol.parse_ctrl(data)
+    if msg is None: return
+    kind, off = msg
+    if kind == protocol.AUDIO and len(data) >= off + protocol.AUDIO_HEADER.size + STAMP.size:
+        stats['recv_audio'] += 1
+        # Paket campuran mixer (--mix, nama pengirim kosong) berisi PCM yang dijumlah: tidak ada timestamp utuh
+        if off > protocol.CTRL_SIZE: lat['audio'].add(now - STAMP.unpack_from(data, off + protocol.AUDIO_HEADER.size)[0])
+
+
+def on_chat(p, now, stats, lat):
+    try: data = p.chat.recv(65536)
+    except BlockingIOError: return
+    except OSError: data = b''
+    if not data: return False
+    p.chat_in += data
+    while len(p.chat_in) >= 4:
+        n = int.from_bytes(p.chat_in[:4], 'big')
+        if len(p.chat_in) < 4 + n: break
+        obj = pickle.loads(bytes(p.chat_in[4:4 + n]))
+        del p.chat_in[:4 + n]
+        stats['recv_chat'] += 1
+        try: lat['chat'].add(now - float(obj['t']))
+        except (KeyError, ValueError): pass
+    return True
+
+
+def run_group(first, count, args, start_at, results):
+    stats = dict.fromkeys(('sent_packets', 'sent_fragments', 'sent_audio', 'sent_chat', 'send_errors',
+                           'recv_packets', 'recv_bytes', 'recv_fragments', 'recv_audio', 'recv_chat'), 0)
+    lat = {'video': Samples(), 'audio': Samples(), 'chat': Samples()}
+    sel = selectors.DefaultSelector()
+    parts = []
+    for idx in range(first, first + count):
+        p = Participant(idx, args.host, args, idx < args.senders)
+        sel.register(p.udp, selectors.EVENT_READ, p)
+        if args.chat_rate > 0:
+            p.chat = socket.create_connection((args.host, server.TCP_CHAT_PORT))
+            p.chat.setblocking(False)
+            sel.register(p.chat, selectors.EVENT_READ, p)
+        p.send(protocol.pack_ctrl(protocol.HELLO, p.name), stats)
+        parts.append(p)
+    # Jadwal disebar supaya semua peserta tidak mengirim di tick yang sama
+    rng = random.Random(first)
+    for p in parts:
+        p.next_frame = start_at + rng.random() / args.fps
+        p.next_audio = start_at + rng.random() * 0.02
+        p.next_chat = start_at + rng.random() / args.chat_rate if args.chat_rate > 0 else float('inf')
+    end = start_at + args.duration
+    measuring = False
+    while True:
+        now = time.monotonic()
+        if now >= end + DRAIN: break
+        if not measuring and now >= start_at:
+            measuring = True
+            for k in stats: stats[k] = 0
+            lat = {'video': Samples(), 'audio': Samples(), 'chat': Samples()}
+        deadline = end + DRAIN
+        for p in parts:
+            if now >= p.next_hello:
+                p.send(protocol.pack_ctrl(protocol.HELLO, p.name), stats)
+                p.next_hello = now + KEEPALIVE
+            if now < start_at or now >= end:
+                deadline = min(deadline, p.next_hello, start_at if now < start_at else deadline)
+                continue
+            if p.sends_video and args.video_kbps > 0:
+                while p.next_frame <= now:
+                    p.send_frame(now, args.fec, stats)
+                    p.next_frame += 1 / args.fps
+                deadline = min(deadline, p.next_frame)
+            if args.audio:
+                while p.next_audio <= now:
+                    p.send_audio(now, stats)
+                    p.next_audio += 0.02
+                deadline = min(deadline, p.next_audio)
+            if p.chat is not None:
+                if p.next_chat <= now:
+                    p.send_chat(now, stats)
+                    p.next_chat = now + 1 / args.chat_rate
+                deadline = min(deadline, p.next_chat)
+            deadline = min(deadline, p.next_hello)
+        for key, _ in sel.select(max(0.0, deadline - time.monotonic())):
+            p = key.data
+            now = time.monotonic()
+            if key.fileobj is p.chat:
+                if on_chat(p, now, stats, lat) is False:
+                    sel.unregister(p.chat); p.chat.close(); p.chat = None
+                continue
+            for _ in range(64):
+                try: data = p.udp.recv(65536)
+                except BlockingIOError: break
+                except OSError: break
+                on_udp(data, now, stats, lat)
+    for p in parts:
+        p.udp.close()
+        if p.chat is not None: p.chat.close()
+    results.put((stats, {k: s.values for k, s in lat.items()}))
+
+
+def proc_cpu(pid):
+    """CPU seconds (user + system) of pid and its direct children from /proc, or None."""
+    tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    total = 0.0
+    try:
+        for name in os.listdir('/proc'):
+            if not name.isdigit(): continue
+            try:
+                with open(f'/proc/{name}/stat') as f: fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(name) == pid or int(fields[1]) == pid:
+                total += (int(fields[11]) + int(fields[12])) / tick
+    except OSError:
+        return None
+    return total
+
+
+def percentiles(values, ps=(50, 90, 99, 99.9)):
+    if not values: return {}
+    v = sorted(values)
+    return {f"p{p:g}": round(v[min(len(v) - 1, int(len(v) * p / 100))] * 1000, 3) for p in ps}
+
+
+def server_option(server_args, name):
+    """Value of `name` in the spawned server's argv (True for a bare flag), or None."""
+    for i, a in enumerate(server_args or ()):
+        if a == name: return server_args[i + 1] if i + 1 < len(server_args) and not server_args[i + 1].startswith('--') else True
+        if a.startswith(name + '='): return a.split('=', 1)[1]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless synthetic participants for load-testing server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--participants", type=int, default=50)
+    parser.add_argument("--senders", type=int, default=None, help="participants sending video (default: all)")
+    parser.add_argument("--video-kbps", type=float, default=500)
+    parser.add_argument("--fps", type=float, default=15)
+    parser.add_argument("--fec", type=float, default=0.1)
+    parser.add_argument("--audio", action="store_true", help="every participant also sends 20 ms audio")
+    parser.add_argument("--chat-rate", type=float, default=0, help="chat messages/s per participant (0 = no TCP)")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--procs", type=int, default=os.cpu_count() or 1, help="generator processes")
+    parser.add_argument("--spawn-server", nargs=argparse.REMAINDER, default=None,
+                        help="start server.py with the remaining arguments and measure its CPU")
+    parser.add_argument("--json", help="append one JSON result line to this file")
+    args = parser.parse_args()
+    if args.senders is None: args.senders = args.participants
+
+    proc = None
+    if args.spawn_server is not None:
+        proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py')] + args.spawn_server,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1.0)
+    try:
+        procs = max(1, min(args.procs, args.participants))
+        per = -(-args.participants // procs)
+        start_at = time.monotonic() + WARMUP
+        results = multiprocessing.Queue()
+        workers = []
+        for first in range(0, args.participants, per):
+            w = multiprocessing.Process(target=run_group, args=(first, min(per, args.participants - first), args, start_at, results))
+            w.start()
+            workers.append(w)
+        time.sleep(max(0, start_at - time.monotonic()))
+        cpu0 = proc_cpu(proc.pid) if proc else None
+        t0 = time.monotonic()
+        parts = [results.get() for _ in workers]
+        wall = time.monotonic() - t0
+        cpu1 = proc_cpu(proc.pid) if proc else None
+        for w in workers: w.join()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    stats = {k: sum(p[0][k] for p in parts) for k in parts[0][0]}
+    lat = {k: [v for p in parts for v in p[1][k]] for k in parts[0][1]}
+    n = args.participants
+    mix = server_option(args.spawn_server, '--mix') is not None
+    last_n = int(server_option(args.spawn_server, '--last-n') or 0)
+    # --last-n sengaja tidak meneruskan video pengirim di luar N teraktif: loss video tidak bermakna
+    expected_frag = stats['sent_fragments'] * (n - 1) if not last_n else 0
+    # --mix: satu paket campuran per frame 20 ms per penerima = sent_audio / n frame x n penerima
+    expected_audio = stats['sent_audio'] if mix else stats['sent_audio'] * (n - 1)
+    expected_chat = stats['sent_chat'] * (n - 1)
+    loss = lambda got, exp: round(1 - got / exp, 5) if exp else None
+    report = {
+        'participants': n, 'senders': args.senders, 'video_kbps': args.video_kbps, 'fps': args.fps,
+        'audio': args.audio, 'chat_rate': args.chat_rate, 'duration': args.duration,
+        'server_args': args.spawn_server,
+        'sent_pps': round(stats['sent_packets'] / args.duration),
+        'forwarded_pps': round(stats['recv_packets'] / args.duration),
+        'forwarded_mbps': round(stats['recv_bytes'] * 8 / 1e6 / args.duration, 2),
+        'loss_video': loss(stats['recv_fragments'], expected_frag),
+        'loss_audio': loss(stats['recv_audio'], expected_audio),
+        'loss_chat': loss(stats['recv_chat'], expected_chat),
+        'latency_ms': {k: percentiles(v) for k, v in lat.items() if v},
+        'server_cpu': round((cpu1 - cpu0) / wall, 3) if cpu0 is not None and cpu1 is not None else None,
+        'send_errors': stats['send_errors'],
+    }
+    print(f"participants={n} senders={args.senders} video={args.video_kbps:g}kbps@{args.fps:g}fps "
+          f"audio={args.audio} chat={args.chat_rate:g}/s duration={args.duration:g}s")
+    print(f"sent {report['sent_pps']} pkt/s -> forwarded {report['forwarded_pps']} pkt/s "
+          f"({report['forwarded_mbps']} Mbit/s)")
+    print(f"loss video={report['loss_video']} audio={report['loss_audio']} chat={report['loss_chat']}")
+    for k, ps in report['latency_ms'].items():
+        print(f"latency {k:>5} ms " + " ".join(f"{p}={v}" for p, v in ps.items()))
+    if report['server_cpu'] is not None: print(f"server cpu {report['server_cpu'] * 100:.1f}% of one core")
+    if args.json:
+        with open(args.json, 'a') as f: f.write(json.dumps(dict(report, time=time.time())) + "\n")
+
+
+if __name__ == "__main__":
+    main()
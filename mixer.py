@@ -0,0 +1,115 @@
+import time
+
+import numpy as np
+
+import protocol
+
+# MCU audio: server mencampur semua suara masuk menjadi satu stream N-1 per penerima
+AUDIO_RATE = 22050
+AUDIO_FRAME = 441           # 20 ms, sama dengan AUDIO_BLOCK client
+PREBUFFER = 2               # frame yang ditunggu per pengirim sebelum mulai dicampur
+MAX_QUEUE = 8               # lebih dari ini: pengirim terlalu jauh di depan, lompat ke yang terbaru
+MAX_CATCHUP = 3             # frame maksimum yang dikejar dalam satu tick setelah loop tersendat
+SENDER_TIMEOUT = 1.0
+LIMIT = 32000               # puncak target limiter (di bawah 32767 supaya ada headroom)
+RELEASE = 0.05              # kenaikan gain limiter per frame setelah puncak lewat
+MIX_USER = b''              # nama pengirim paket campuran
+
+
+class SenderAudio:
+    __slots__ = ('frames', 'next_seq', 'playing', 'level', 'last')
+
+    def __init__(self):
+        self.frames = {}
+        self.next_seq = 0
+        self.playing = False
+        self.level = protocol.LEVEL_SILENT
+        self.last = time.monotonic()
+
+    def pop(self):
+        if not self.playing and len(self.frames) < PREBUFFER: return None
+        if not self.playing or len(self.frames) > MAX_QUEUE:
+            # Mulai (atau lompat) dari PREBUFFER frame terbaru; yang lebih tua dibuang
+            ref = next(iter(self.frames))
+            order = sorted(self.frames, key=lambda s: protocol.seq_diff(s, ref))
+            for s in order[:-PREBUFFER]: del self.frames[s]
+            self.next_seq = order[-PREBUFFER]
+            self.playing = True
+        frame = self.frames.pop(self.next_seq, None)
+        self.next_seq = (self.next_seq + 1) & 0xFFFF
+        if frame is None and not self.frames: self.playing = False
+        return frame
+
+
+class Mixer:
+    """Fixed 20 ms N-1 mixer: one AUDIO packet per frame per receiver instead of N-1."""
+
+    def __init__(self, frame=AUDIO_FRAME, rate=AUDIO_RATE):
+        self.frame = frame
+        self.frame_dur = frame / rate
+        self.user = MIX_USER
+        self.senders = {}
+        self.gains = {}
+        self.seq = 0
+        self.start = None
+        self.produced = 0
+        self.limited = 0
+
+    def push(self, src, seq, level, pcm):
+        if len(pcm) != self.frame * 2: return
+        st = self.senders.get(src)
+        if st is None: st = self.senders[src] = SenderAudio()
+        if st.playing and protocol.seq_diff(seq, st.next_seq) < 0: return   # terlambat
+        st.frames[seq] = np.frombuffer(pcm, np.int16)
+        st.level = level
+        st.last = time.monotonic()
+
+    def due(self, now):
+        """Number of frames to mix now to stay on the 20 ms clock."""
+        if self.start is None: self.start = now
+        due = int((now - self.start) / self.frame_dur) - self.produced
+        if due > MAX_CATCHUP:
+            self.produced += due - MAX_CATCHUP
+            due = MAX_CATCHUP
+        return due
+
+    def mix(self, receivers, now):
+        """Mix one frame; return [(receiver, AUDIO body)] for receivers that hear anyone."""
+        self.produced += 1
+        srcs, rows, level = [], [], protocol.LEVEL_SILENT
+        for src in list(self.senders):
+            st = self.senders[src]
+            f = st.pop()
+            if f is None:
+                if now - st.last > SENDER_TIMEOUT:
+                    del self.senders[src]
+                    self.gains.pop(src, None)
+                continue
+            srcs.append(src); rows.append(f); level = min(level, st.level)
+        if not rows: return []
+        self.seq = (self.seq + 1) & 0xFFFF
+        frames = np.stack(rows).astype(np.int32)
+        total = frames.sum(axis=0)
+        index = {s: i for i, s in enumerate(srcs)}
+        # Baris i = total dikurangi suara penerima i sendiri; pendengar murni mendapat total
+        mixes = np.vstack((total - frames, total))
+        peaks = np.abs(mixes).max(axis=1)
+        out = []
+        for r in receivers:
+            i = index.get(r, len(srcs))
+            if i < len(srcs) and len(srcs) == 1: continue   # hanya dirinya sendiri yang bicara
+            peak = int(peaks[i])
+            if not peak: continue
+            g = self.gains.get(r, 1.0)
+            target = min(1.0, LIMIT / peak)
+            g = target if target < g else min(1.0, g + RELEASE, target)
+            self.gains[r] = g
+            m = mixes[i]
+            if g < 1.0:
+                m = m * g
+                self.limited += 1
+            pcm = np.clip(m, -32768, 32767).astype(np.int16).tobytes()
+            out.append((r, protocol.pack_audio(self.seq, pcm, level)))
+        if len(self.gains) > 2 * len(receivers) + 8:
+            self.gains = {r: self.gains[r] for r in receivers if r in self.gains}
+        return out
@@ -0,0 +1,331 @@
+import struct
+
+# Format paket UDP Locus. Byte pertama selalu jenis paket sehingga server bisa
+# merutekan tanpa membongkar isi; paket kontrol membawa byte versi di offset 1.
+VERSION = 6
+
+VIDEO = 0xFF        # fragmen JPEG, layout sendiri (lihat VIDEO_HEADER)
+HELLO = 0x01
+OFFCAM = 0x02
+AUDIO = 0x03
+LAYER = 0x04        # permintaan layer simulcast dari penerima ke server
+FEEDBACK = 0x05     # laporan penerima tentang satu pengirim, dirutekan server ke pengirim itu
+KEYFRAME = 0x06     # penerima minta keyframe (rantai delta putus), dirutekan seperti FEEDBACK
+SPEAKERS = 0x07     # server -> client: pembicara aktif, paling baru bicara duluan
+PIN = 0x08          # client -> server: pengirim yang videonya selalu ingin diterima
+COMFORT_NOISE = 0x09    # pengirim diam (VAD): body AUDIO tanpa PCM, level = level noise latar
+SUBSCRIBE = 0x0A    # client -> server: pengirim yang sedang digambar beserta layer dan fps maksimum
+ROUTED = (FEEDBACK, KEYFRAME)   # body diawali nama target
+
+FLAG_DEAF = 1
+FLAG_MUTE = 2
+FLAG_DELTA = 16     # bit 2-3 = layer simulcast; frame ini delta terhadap frame sebelumnya (lihat codec.py)
+FLAG_TIMESTAMP = 32 # fragmen membawa SEND_TIME setelah byte flags
+FLAG_CACHED = 64    # diputar ulang server dari frame cache untuk peserta baru, bukan bagian aliran live
+
+# Kontrol: kind, version, panjang username | username | body
+CTRL_HEADER = struct.Struct("!BBB")
+CTRL_SIZE = CTRL_HEADER.size
+# Video: 0xFF, version, seq 32-bit, panjang frame, idx, total, parity, panjang username | username | flags | chunk
+# Frame dipotong rata menjadi `total` chunk sehingga offset chunk = idx * chunk_size(frame_len, total).
+# idx >= total adalah paket parity XOR grup (idx - total); chunk j masuk grup j % parity.
+VIDEO_HEADER = struct.Struct("!BBIIHHHB")
+# Waktu kirim fragmen (opsional, FLAG_TIMESTAMP): mikrodetik jam monotonic pengirim, 32-bit wrap.
+# Hanya selisihnya yang bermakna: penerima memakainya untuk variasi delay satu arah.
+SEND_TIME = struct.Struct("!I")
+MAX_FRAME_LEN = 8 * 1024 * 1024
+FRAME_WINDOW = 4        # frame yang boleh sedang dirakit bersamaan per pengirim
+FRAME_TIMEOUT = 0.5
+RESYNC_GAP = 1000       # loncatan seq sebesar ini dianggap pengirim restart
+# Body AUDIO: nomor urut 16-bit, level | PCM int16 mono
+# Level seperti RFC 6464: -dBov 0..127, 0 = paling keras, 127 = diam
+AUDIO_HEADER = struct.Struct("!HB")
+LEVEL_SILENT = 127
+# Body FEEDBACK: panjang nama target | nama target | loss, completion (permil), jitter ms, kbps, fragmen dipulihkan FEC
+FEEDBACK_BODY = struct.Struct("!HHHHH")
+# Body KEYFRAME: panjang nama target | nama target | layer
+# Body SPEAKERS / PIN: jumlah nama | (panjang nama | nama)...
+# Body SUBSCRIBE: jumlah | (panjang nama | nama | layer | fps maksimum, 0 = tanpa batas)...
+
+
+def pack_ctrl(kind, user_b, body=b''):
+    return CTRL_HEADER.pack(kind, VERSION, len(user_b)) + user_b + body
+
+
+def parse_ctrl(data):
+    """Return (kind, body offset) from the header only, or None if malformed/other version."""
+    if len(data) < CTRL_SIZE or data[1] != VERSION: return None
+    off = CTRL_SIZE + data[2]
+    return (data[0], off) if off <= len(data) else None
+
+
+def unpack_ctrl(data):
+    """Return (kind, username, body) or None."""
+    if len(data) < CTRL_SIZE or data[1] != VERSION: return None
+    off = CTRL_SIZE + data[2]
+    if off > len(data): return None
+    return data[0], data[CTRL_SIZE:off].decode('utf-8', 'replace'), data[off:]
+
+
+def pack_audio(seq, pcm, level=LEVEL_SILENT):
+    return AUDIO_HEADER.pack(seq & 0xFFFF, level) + pcm
+
+
+def unpack_audio(body):
+    """Return (seq, level, pcm bytes) of an AUDIO body."""
+    seq, level = AUDIO_HEADER.unpack_from(body)
+    return seq, level, body[AUDIO_HEADER.size:]
+
+
+def pack_names(names):
+    names = names[:255]
+    return bytes((len(names),)) + b''.join(bytes((len(n),)) + n for n in names)
+
+
+def unpack_names(body, off=0):
+    """Return the list of byte-string names packed by pack_names."""
+    names = []
+    if off >= len(body): return names
+    count, off = body[off], off + 1
+    for _ in range(count):
+        if off >= len(body): break
+        n = body[off]
+        names.append(bytes(body[off + 1:off + 1 + n]))
+        off += 1 + n
+    return names
+
+
+def pack_subscriptions(subs):
+    """subs: {name bytes: (layer, max fps)}."""
+    items = list(subs.items())[:255]
+    return bytes((len(items),)) + b''.join(bytes((len(n),)) + n + bytes((layer, min(255, int(fps))))
+                                           for n, (layer, fps) in items)
+
+
+def unpack_subscriptions(body, off=0):
+    """Return {name bytes: (layer, max fps)} packed by pack_subscriptions."""
+    subs = {}
+    if off >= len(body): return subs
+    count, off = body[off], off + 1
+    for _ in range(count):
+        if off >= len(body): break
+        n = body[off]
+        if off + 1 + n + 2 > len(body): break
+        subs[bytes(body[off + 1:off + 1 + n])] = (min(body[off + 1 + n], 3), body[off + 2 + n])
+        off += 3 + n
+    return subs
+
+
+def pack_feedback(target_b, loss, completion, jitter_ms, kbps, recovered=0):
+    return bytes((len(target_b),)) + target_b + FEEDBACK_BODY.pack(
+        min(1000, int(loss * 1000)), min(1000, int(completion * 1000)), min(0xFFFF, int(jitter_ms)),
+        min(0xFFFF, int(kbps)), min(0xFFFF, int(recovered)))
+
+
+def pack_keyframe_request(target_b, layer):
+    return bytes((len(target_b),)) + target_b + bytes((layer,))
+
+
+def unpack_keyframe_request(body):
+    """Return (target username, layer) of a KEYFRAME body."""
+    off = 1 + body[0]
+    return body[1:off].decode('utf-8', 'replace'), body[off] if off < len(body) else 0
+
+
+def routed_target(body):
+    return body[1:1 + body[0]]
+
+
+def unpack_feedback(body):
+    """Return (target username, loss, completion, jitter ms, kbps, recovered) of a FEEDBACK body."""
+    off = 1 + body[0]
+    loss, completion, jitter_ms, kbps, recovered = FEEDBACK_BODY.unpack_from(body, off)
+    return body[1:off].decode('utf-8', 'replace'), loss / 1000, completion / 1000, jitter_ms, kbps, recovered
+
+
+def seq_diff(a, b):
+    """Signed distance a - b between 16-bit sequence numbers."""
+    return ((a - b + 0x8000) & 0xFFFF) - 0x8000
+
+
+def pack_flags(mute, deaf, layer=0, delta=False):
+    return (layer << 2) | (FLAG_DELTA if delta else 0) | (FLAG_MUTE if mute else 0) | (FLAG_DEAF if deaf else 0)
+
+
+def pack_video_header(seq, frame_len, idx, total, parity, user_b, flags, send_time=None):
+    head = VIDEO_HEADER.pack(VIDEO, VERSION, seq & 0xFFFFFFFF, frame_len, idx, total, parity, len(user_b)) + user_b
+    if send_time is None: return head + bytes((flags,))
+    return head + bytes((flags | FLAG_TIMESTAMP,)) + SEND_TIME.pack(int(send_time * 1e6) & 0xFFFFFFFF)
+
+
+def send_time(data, off):
+    """Sender timestamp (us, wrapping) of a fragment with FLAG_TIMESTAMP; `off` is parse_video's chunk offset."""
+    return SEND_TIME.unpack_from(data, off - SEND_TIME.size)[0]
+
+
+def chunk_size(frame_len, total):
+    return -(-frame_len // total) if total else 0
+
+
+def split_frame(frame_len, max_payload):
+    """Return (total, chunk size) for an even split of a frame into at most max_payload chunks."""
+    total = max(1, -(-frame_len // max_payload))
+    return total, chunk_size(frame_len, total)
+
+
+def parse_video(data):
+    """Return (seq, frame_len, idx, total, parity, username, flags, chunk offset) or None."""
+    if len(data) <= VIDEO_HEADER.size or data[1] != VERSION: return None
+    _, _, seq, frame_len, idx, total, parity, u_len = VIDEO_HEADER.unpack_from(data)
+    off = VIDEO_HEADER.size + u_len
+    if off >= len(data): return None
+    username = bytes(data[VIDEO_HEADER.size:off]).decode('utf-8', 'replace')
+    flags = data[off]
+    off += 1 + (SEND_TIME.size if flags & FLAG_TIMESTAMP else 0)
+    if off > len(data): return None
+    return seq, frame_len, idx, total, parity, username, flags, off
+
+
+def fec_groups(total, ratio):
+    """Number of XOR parity packets for a frame of `total` chunks at redundancy `ratio`."""
+    if ratio <= 0 or total < 2: return 0
+    return min(total, max(1, int(total * ratio + 0.999)))
+
+
+def xor_parity(view, total, size, groups):
+    """Return one parity payload per interleaved group; chunk j belongs to group j % groups."""
+    acc = [0] * groups
+    for j in range(total):
+        acc[j % groups] ^= int.from_bytes(view[j * size:(j + 1) * size], 'little')
+    return [a.to_bytes(size, 'little') for a in acc]
+
+
+def video_flags_offset(data):
+    """Offset of the flags byte of a video fragment, or None if truncated."""
+    if len(data) <= VIDEO_HEADER.size: return None
+    off = VIDEO_HEADER.size + data[VIDEO_HEADER.size - 1]
+    return off if off < len(data) else None
+
+
+def video_flags(data):
+    off = video_flags_offset(data)
+    return data[off] if off is not None else 0
+
+
+def video_layer(data):
+    return (video_flags(data) >> 2) & 3
+
+
+def seq_diff32(a, b):
+    return ((a - b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class PartialFrame:
+    __slots__ = ('buf', 'got', 'received', 'total', 'chunk', 'ts', 'groups', 'parity')
+
+    def __init__(self, frame_len, total, groups, now):
+        self.buf = bytearray(frame_len)
+        self.got = bytearray(total)
+        self.received = 0
+        self.total = total
+        self.chunk = chunk_size(frame_len, total)
+        self.ts = now
+        self.groups = groups
+        self.parity = {}
+
+
+class FrameAssembler:
+    """Reassembles one sender's video fragments straight into preallocated frame buffers.
+
+    Up to `window` frames may be in flight, so reordering between frames does
+    not discard them. Completing a frame releases it and drops every older
+    partial frame. Every sequence number between two delivered frames is
+    counted once as dropped. Fragments for frames before the last
+    delivered one are late. A parity group missing exactly one chunk is
+    rebuilt by XOR and counted as recovered.
+    """
+
+    def __init__(self, window=FRAME_WINDOW, timeout=FRAME_TIMEOUT):
+        self.window = window
+        self.timeout = timeout
+        self.frames = {}
+        self.seen = set()
+        self.last_done = None
+        self.last_late = None
+        self.fragments = self.expected = 0
+        self.completed = self.dropped = self.late = 0
+        self.recovered = 0
+
+    def add(self, seq, frame_len, idx, total, parity, payload, now):
+        """Store one fragment; return the frame buffer once it completes, else None."""
+        if self.last_done is not None:
+            d = seq_diff32(seq, self.last_done)
+            if d <= -RESYNC_GAP or d >= RESYNC_GAP:
+                self.frames.clear(); self.seen.clear(); self.last_done = None
+            elif d == 0:
+                self.fragments += 1   # sisa paket (mis. parity) dari frame yang sudah selesai
+                return None
+            elif d < 0:
+                if seq != self.last_late: self.late += 1; self.last_late = seq
+                return None
+        f = self.frames.get(seq)
+        if f is None:
+            if not 0 < total or idx >= total + parity or frame_len > MAX_FRAME_LEN: return None
+            f = self.frames[seq] = PartialFrame(frame_len, total, parity, now)
+            self.seen.add(seq)
+            self.expected += total + parity
+            self.evict(now, seq)
+        if idx >= f.total:
+            g = idx - f.total
+            if g >= f.groups or g in f.parity or len(payload) != f.chunk: return None
+            f.parity[g] = bytes(payload)
+        else:
+            if f.got[idx]: return None
+            start = idx * f.chunk
+            end = start + len(payload)
+            if end > len(f.buf): return None
+            f.buf[start:end] = payload
+            f.got[idx] = 1
+            f.received += 1
+            g = idx % f.groups if f.groups else None
+        self.fragments += 1
+        if g is not None and g in f.parity: self.recover(f, g)
+        if f.received < f.total: return None
+        return self.complete(seq, f)
+
+    def recover(self, f, g):
+        missing = [j for j in range(g, f.total, f.groups) if not f.got[j]]
+        if len(missing) != 1: return
+        j = missing[0]
+        size = f.chunk
+        acc = int.from_bytes(f.parity[g], 'little')
+        for k in range(g, f.total, f.groups):
+            if k != j: acc ^= int.from_bytes(f.buf[k * size:(k + 1) * size], 'little')
+        start = j * size
+        end = min(start + size, len(f.buf))
+        f.buf[start:end] = acc.to_bytes(size, 'little')[:end - start]
+        f.got[j] = 1
+        f.received += 1
+        self.recovered += 1
+
+    def complete(self, seq, f):
+        del self.frames[seq]
+        for s in [s for s in self.frames if seq_diff32(s, seq) < 0]: del self.frames[s]
+        if self.last_done is not None:
+            skipped = seq_diff32(seq, self.last_done) - 1
+            seen = sum(1 for s in self.seen if seq_diff32(s, seq) < 0)
+            self.dropped += skipped
+            # Frame yang tidak pernah terlihat: perkirakan jumlah fragmennya dari frame ini
+            self.expected += max(0, skipped - seen) * f.total
+        self.seen = {s for s in self.seen if seq_diff32(s, seq) > 0}
+        self.last_done = seq
+        self.completed += 1
+        return f.buf
+
+    def evict(self, now, newest):
+        for s in [s for s, f in self.frames.items() if now - f.ts > self.timeout and s != newest]:
+            del self.frames[s]
+        while len(self.frames) > self.window:
+            del self.frames[min(self.frames, key=lambda s: seq_diff32(s, newest))]
+        if len(self.seen) > 256:
+            self.seen = {s for s in self.seen if seq_diff32(newest, s) < 256}
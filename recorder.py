@@ -0,0 +1,222 @@
+import argparse
+import heapq
+import json
+import mmap
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+import protocol
+
+# Rekaman server: paket UDP mentah (fragmen JPEG, audio, status kamera) apa adanya, tanpa encode ulang.
+# Layout direktori:
+#   meta.json   versi, waktu mulai, daftar nama pengirim (id = posisi di daftar)
+#   index.idx   record tetap INDEX per paket, urut waktu; bisa di-mmap sebagai array numpy
+#   NNNNN.seg   isi paket bersambung, append-only; segmen baru setiap SEGMENT_BYTES
+FORMAT_VERSION = 1
+INDEX = struct.Struct("<dHHII")     # waktu (epoch detik), id pengirim, segmen, offset, panjang
+INDEX_DTYPE = np.dtype([('ts', '<f8'), ('sender', '<u2'), ('segment', '<u2'), ('offset', '<u4'), ('length', '<u4')])
+SEGMENT_BYTES = 256 * 1024 * 1024
+RECORD_QUEUE = 50000        # paket menunggu writer; lebih dari ini paket rekaman dibuang, forwarding jalan terus
+FLUSH_INTERVAL = 0.5        # index di-flush sesering ini supaya pembaca mmap melihat rekaman yang sedang berjalan
+RECORD_KINDS = (protocol.VIDEO, protocol.AUDIO, protocol.COMFORT_NOISE, protocol.OFFCAM)
+UDP_PORT = 9999
+
+
+class Recorder:
+    """Append-only packet recorder; `write` only enqueues, a daemon thread does the I/O."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'index.idx')): raise FileExistsError(f"{path} already holds a recording")
+        # Waktu dari jam monotonic yang dijangkar ke wall clock: index tetap urut walau jam sistem digeser
+        self.start = time.time()
+        self.start_mono = time.monotonic()
+        self.senders = {}
+        self.queue = queue.Queue(RECORD_QUEUE)
+        self.dropped = 0
+        self.packets = 0
+        self.bytes = 0
+        self.segment = -1
+        self.seg_file = None
+        self.seg_size = 0
+        self.index = open(os.path.join(path, 'index.idx'), 'ab')
+        self.write_meta()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def write(self, data, sender, now):
+        """Queue one relayed packet; never blocks (drops and counts when the writer falls behind)."""
+        try: self.queue.put_nowait((now, sender, data))
+        except queue.Full: self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(5)
+
+    def write_meta(self):
+        names = [n.decode('utf-8', 'replace') for n in sorted(self.senders, key=self.senders.get)]
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'start': self.start, 'segment_bytes': SEGMENT_BYTES,
+                       'senders': names}, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def next_segment(self):
+        if self.seg_file: self.seg_file.close()
+        self.segment += 1
+        self.seg_file = open(os.path.join(self.path, f"{self.segment:05d}.seg"), 'ab')
+        self.seg_size = 0
+
+    def loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try: item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty: item = False
+            batch = [item] if item else []
+            # Ambil semua yang sudah menunggu sekaligus: satu write index + satu write segmen per batch
+            while item is not None and len(batch) < 4096:
+                try: item = self.queue.get_nowait()
+                except queue.Empty: break
+                if item: batch.append(item)
+            if batch: self.write_batch(batch)
+            now = time.monotonic()
+            if item is None or now - last_flush >= FLUSH_INTERVAL:
+                self.index.flush()
+                if self.seg_file: self.seg_file.flush()
+                last_flush = now
+            if item is None: break
+        self.index.close()
+        if self.seg_file: self.seg_file.close()
+
+    def write_batch(self, batch):
+        recs, chunks = [], []
+        new_sender = False
+        for now, sender, data in batch:
+            sid = self.senders.get(sender)
+            if sid is None:
+                sid = self.senders[sender] = len(self.senders)
+                new_sender = True
+            if self.seg_file is None or self.seg_size + len(data) > SEGMENT_BYTES:
+                if chunks: self.seg_file.write(b''.join(chunks)); chunks = []
+                self.next_segment()
+            recs.append(INDEX.pack(self.start + (now - self.start_mono), sid, self.segment, self.seg_size, len(data)))
+            chunks.append(data)
+            self.seg_size += len(data)
+            self.bytes += len(data)
+        self.seg_file.write(b''.join(chunks))
+        # Segmen ditulis dulu: record index tidak pernah menunjuk data yang belum ada di file
+        self.seg_file.flush()
+        self.index.write(b''.join(recs))
+        self.packets += len(batch)
+        if new_sender: self.write_meta()
+
+
+class Recording:
+    """Read side: the index is a memory-mapped structured array, segments are mmapped on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f: self.meta = json.load(f)
+        self.senders = self.meta['senders']
+        count = os.path.getsize(os.path.join(path, 'index.idx')) // INDEX_DTYPE.itemsize
+        # Record terakhir bisa setengah tertulis kalau server mati: hanya record utuh yang dipetakan
+        self.index = (np.memmap(os.path.join(path, 'index.idx'), INDEX_DTYPE, 'r', shape=(count,))
+                      if count else np.zeros(0, INDEX_DTYPE))
+        self.segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        return float(self.index['ts'][-1] - self.index['ts'][0]) if len(self.index) else 0.0
+
+    def seek(self, t):
+        """Index of the first packet at or after `t` seconds into the recording."""
+        if not len(self.index): return 0
+        return int(np.searchsorted(self.index['ts'], self.index['ts'][0] + t))
+
+    def packet(self, i):
+        rec = self.index[i]
+        seg = self.segments.get(int(rec['segment']))
+        if seg is None:
+            with open(os.path.join(self.path, f"{int(rec['segment']):05d}.seg"), 'rb') as f:
+                seg = self.segments[int(rec['segment'])] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        off = int(rec['offset'])
+        return seg[off:off + int(rec['length'])]
+
+    def packets(self, start=0):
+        """Yield (timestamp, sender name, packet) from packet index `start`."""
+        ts, senders = self.index['ts'], self.index['sender']
+        for i in range(start, len(self.index)):
+            yield float(ts[i]), self.senders[int(senders[i])], self.packet(i)
+
+
+def replay(paths, host, seek=0.0, speed=1.0):
+    """Send recorded packets to a relay at their original timing, one UDP socket per recorded sender."""
+    recs = [Recording(p) for p in paths]
+    start = min((float(r.index['ts'][0]) for r in recs if len(r)), default=None)
+    if start is None:
+        print("Empty recording")
+        return
+    # Beberapa direktori (rekaman per worker) digabung urut waktu
+    streams = [r.packets(r.seek(start + seek - float(r.index['ts'][0]))) for r in recs if len(r)]
+    socks = {}
+    dest = (host, UDP_PORT)
+    t0 = time.monotonic()
+    base = start + seek
+    sent = 0
+    last_hello = time.monotonic()
+    try:
+        for ts, name, data in heapq.merge(*streams, key=lambda p: p[0]):
+            sock = socks.get(name)
+            if sock is None:
+                sock = socks[name] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.sendto(protocol.pack_ctrl(protocol.HELLO, name.encode('utf-8')), dest)
+            delay = (ts - base) / speed - (time.monotonic() - t0)
+            if delay > 0: time.sleep(delay)
+            try: sock.sendto(data, dest)
+            except OSError: pass
+            sent += 1
+            now = time.monotonic()
+            if now - last_hello > 1.0:
+                # Pengirim yang sedang diam tetap hidup di server (CLIENT_TIMEOUT)
+                for n, s in socks.items(): s.sendto(protocol.pack_ctrl(protocol.HELLO, n.encode('utf-8')), dest)
+                last_hello = now
+    except KeyboardInterrupt:
+        pass
+    print(f"▶️ Replayed {sent} packets from {len(socks)} senders in {time.monotonic() - t0:.1f}s")
+
+
+def info(paths):
+    for p in paths:
+        r = Recording(p)
+        kinds = {}
+        for i in range(len(r)):
+            k = r.packet(i)[0]
+            kinds[k] = kinds.get(k, 0) + 1
+        names = {protocol.VIDEO: 'video', protocol.AUDIO: 'audio', protocol.COMFORT_NOISE: 'cn', protocol.OFFCAM: 'offcam'}
+        print(f"{p}: {len(r)} packets, {r.duration:.1f}s, senders {r.senders}")
+        print("   " + ", ".join(f"{names.get(k, k)}={n}" for k, n in sorted(kinds.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay recordings made with server.py --record")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("info", help="packet counts, duration and senders")
+    p.add_argument("paths", nargs="+")
+    p = sub.add_parser("replay", help="send a recording into a running relay at original timing")
+    p.add_argument("paths", nargs="+", help="recording directory (several = per-worker recordings, merged)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--seek", type=float, default=0.0, help="start this many seconds into the recording")
+    p.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+    if args.cmd == "info": info(args.paths)
+    else: replay(args.paths, args.host, args.seek, args.speed)
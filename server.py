@@ -1,124 +1,993 @@
+import os
+import signal
 import socket
-import threading
+import selectors
+import struct
 import time
 import sys
+import argparse
+import bisect
+import json
+import multiprocessing
+from collections import OrderedDict, deque
+
+import protocol
 
 HOST = '0.0.0.0'
 UDP_PORT = 9999
 TCP_CHAT_PORT = 9997
+STATS_PORT = 9980       # HTTP lokal: /stats (JSON) dan /metrics (Prometheus); worker k memakai STATS_PORT + k
 
-udp_clients = {} 
-tcp_clients = []
-lock = threading.Lock()
-server_running = True
+CLIENT_TIMEOUT = 5      # detik tanpa paket sebelum client UDP dianggap keluar
+SWEEP_INTERVAL = 1.0
+UDP_BATCH = 64          # datagram maksimum per wakeup sebelum kembali ke select()
 
-def udp_listener():
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try: udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 10)
-    except: pass
-    
-    try:
-        udp_sock.bind((HOST, UDP_PORT))
-        print(f"✅ UDP Server (Video) running on {HOST}:{UDP_PORT}")
-    except OSError as e:
-        print(f"❌ Gagal bind UDP: {e}")
-        return
+# Registry antar worker: op (J=join, L=leave) diikuti record alamat IPv4
+# (4 byte ip + 2 byte port) dan layer simulcast yang diminta peer tersebut.
+# S = aktivitas bicara: record (umur ms sejak terakhir bicara, panjang nama) + nama.
+# P = pin: satu record alamat diikuti daftar nama (protocol.pack_names).
+# U = langganan: satu record alamat diikuti body SUBSCRIBE (protocol.pack_subscriptions).
+HUB_ADDR = struct.Struct("!4sHB")
+HUB_SPEAKER = struct.Struct("!IB")
+NEVER_SPOKE = 0xFFFFFFFF
+HUB_MAX_ADDRS = 1000
+
+# Antrian kirim per penerima: fragmen video boleh dibuang, audio/kontrol diprioritaskan
+VIDEO_QUEUE_BYTES = 2 * 1024 * 1024
+VIDEO_MAX_AGE = 0.2     # fragmen video lebih tua dari ini sudah basi
+CTRL_QUEUE_LEN = 256
+FRAME_CACHE_BYTES = 32 * 1024 * 1024   # frame independen terakhir per pengirim, untuk peserta yang baru join
+CHAT_MAX_BUFFER = 4 * 1024 * 1024   # peer chat yang macet melebihi ini diputus
+CHAT_HISTORY = 200                  # pesan terakhir yang diputar ulang ke client chat baru
+CHAT_HISTORY_BYTES = 512 * 1024
+STATS_INTERVAL = 5.0
+
+# Simulcast: byte flags fragmen video membawa layer di bit 2-3 (0 = resolusi penuh)
+LAYER_TTL = 1.0         # layer dianggap tersedia selama pengirim mengirimnya dalam jendela ini
+
+# Last-N: hanya video N pembicara terakhir (plus yang di-pin penerima) yang diteruskan
+SPEECH_LEVEL = 50       # -dBov; paket audio dengan level <= ini dihitung bicara
+SPEECH_PACKETS = 5      # paket bicara berturut-turut (100 ms) sebelum dianggap pembicara aktif
+SPEAKER_INTERVAL = 0.25
+SPEAKER_ANNOUNCE = 0.2  # jeda minimal kabar bicara ke worker lain per peer
+SPEAKERS_MAX = 16       # nama per paket SPEAKERS
+# Langganan penerima: pengirim yang tidak digambar hanya dapat thumbnail (frame independen, layer terkecil)
+THUMB_FPS = 1.0
+THUMB_LAYER = 3
+MIX_TICK = 0.005        # resolusi timer mode MCU (--mix); mixer sendiri menjaga jam 20 ms
+
+
+# Batas bucket histogram latensi fan-out (detik), gaya Prometheus
+FANOUT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def cumulative(self):
+        out, acc = [], 0
+        for le, c in zip(list(self.bounds) + [float('inf')], self.counts):
+            acc += c
+            out.append((le, acc))
+        return out
+
+
+def pick_layer(available, wanted):
+    # Layer terkecil yang tidak lebih buruk dari permintaan; kalau tidak ada, yang terkecil tersedia
+    best = None
+    for layer in available:
+        if layer <= wanted and (best is None or layer > best): best = layer
+    return best if best is not None else min(available)
+
+
+class FrameCache:
+    """Data fragments of each sender's latest complete independent (non-delta) frame, per layer.
+
+    Bounded by total bytes; the least recently refreshed sender/layer is
+    evicted first. Parity fragments are not kept since the cached frame is
+    always complete.
+    """
+
+    def __init__(self, limit=FRAME_CACHE_BYTES):
+        self.limit = limit
+        self.frames = OrderedDict()     # (addr, layer) -> (fragmen, byte)
+        self.building = {}              # (addr, layer) -> (seq, total, fragmen)
+        self.bytes = 0
+
+    def add(self, key, data, seq, idx, total):
+        if idx >= total: return
+        b = self.building.get(key)
+        if b is None or b[0] != seq: b = self.building[key] = (seq, total, [])
+        b[2].append(data)
+        if len(b[2]) < total: return
+        del self.building[key]
+        old = self.frames.pop(key, None)
+        if old: self.bytes -= old[1]
+        size = sum(len(f) for f in b[2])
+        self.frames[key] = (b[2], size)
+        self.bytes += size
+        while self.bytes > self.limit and self.frames:
+            self.bytes -= self.frames.popitem(last=False)[1][1]
+
+    def layers(self, addr):
+        return {k[1]: v[0] for k, v in self.frames.items() if k[0] == addr}
+
+    def drop(self, addr):
+        for key in [k for k in self.frames if k[0] == addr]: self.bytes -= self.frames.pop(key)[1]
+        for key in [k for k in self.building if k[0] == addr]: del self.building[key]
+
+
+class Peer:
+    """A UDP participant: liveness plus its own bounded outbound queues and counters."""
+
+    def __init__(self, addr, local=True):
+        self.addr = addr
+        self.local = local
+        self.last_seen = time.monotonic()
+        self.ctrl = deque()
+        self.video = deque()
+        self.video_bytes = 0
+        self.sent = 0
+        self.bytes_out = 0
+        self.pkts_in = 0
+        self.bytes_in = 0
+        self.drops_video = 0
+        self.drops_ctrl = 0
+        self.errors = 0
+        self.reported_drops = 0
+        self.layer = 0
+        self.layers = {}
+        self.name = None
+        self.video_flags = 0    # flags fragmen video terakhir (mute/deaf terkini)
+        self.offcam = None      # paket OFFCAM terakhir selama kamera mati
+        self.loud = 0
+        self.spoke_announced = 0.0
+        self.pinned = set()
+        self.subs = None        # None = belum berlangganan: terima semua (client lama, loadgen)
+        self.sub_state = {}     # (nama pengirim, layer) -> [waktu frame berikut boleh lewat, rantai delta utuh]
+        self.sub_frame = {}     # layer -> (seq, penerima) keputusan langganan untuk frame terakhir layer itu
+
+    def push(self, data, now):
+        if data[0] == protocol.VIDEO:
+            self.video.append((now, data))
+            self.video_bytes += len(data)
+            while self.video_bytes > VIDEO_QUEUE_BYTES:
+                self.video_bytes -= len(self.video.popleft()[1])
+                self.drops_video += 1
+        else:
+            if len(self.ctrl) >= CTRL_QUEUE_LEN:
+                self.ctrl.popleft()
+                self.drops_ctrl += 1
+            self.ctrl.append(data)
+
+    def pop(self, now):
+        if self.ctrl: return self.ctrl.popleft()
+        while self.video:
+            ts, data = self.video.popleft()
+            self.video_bytes -= len(data)
+            if now - ts <= VIDEO_MAX_AGE: return data
+            self.drops_video += 1
+        return None
+
+    def requeue(self, data, now):
+        if data[0] == protocol.VIDEO:
+            self.video.appendleft((now, data))
+            self.video_bytes += len(data)
+        else:
+            self.ctrl.appendleft(data)
+
+    def stats(self):
+        return {'name': self.name.decode('utf-8', 'replace') if self.name else None, 'local': self.local,
+                'pkts_in': self.pkts_in, 'bytes_in': self.bytes_in, 'sent': self.sent, 'bytes_out': self.bytes_out,
+                'drops_video': self.drops_video, 'drops_ctrl': self.drops_ctrl,
+                'errors': self.errors, 'queued': len(self.ctrl) + len(self.video)}
+
+
+class StatsConn:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = b''
+
+
+class ChatConn:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.writing = False    # EVENT_WRITE sedang terdaftar
+
+
+class Relay:
+    """Single-threaded relay: UDP video/audio forwarding and TCP chat on one selector.
+
+    In multi-worker mode each worker process runs a UDP-only Relay bound with
+    SO_REUSEPORT and the parent runs the TCP-only Relay that also passes
+    registry updates between workers over `hub` sockets.
+    """
+
+    def __init__(self, host=HOST, udp=True, tcp=True, hub=None, reuseport=False, last_n=0, mix=False,
+                 stats_port=0, worker=0, record=None):
+        self.host = host
+        self.use_udp = udp
+        self.use_tcp = tcp
+        self.reuseport = reuseport
+        self.sel = selectors.DefaultSelector()
+        self.peers = {}
+        self.names = {}
+        self.pending = {}
+        self.udp_writable = False
+        self.tcp_clients = {}
+        self.timers = []
+        self.running = True
+        self.udp_sock = None
+        self.tcp_sock = None
+        self.hub = hub
+        self.worker_hubs = []
+        self.parent_pid = os.getppid()
+        # Pembicara per nama (termasuk yang dikabarkan worker lain): urutan dict = urutan join
+        self.last_n = last_n
+        self.spoke = {}
+        self.speaker_seen = {}
+        self.ranking = []
+        self.active = set()
+        self.stats_port = stats_port
+        self.worker = worker
+        self.stats_sock = None
+        self.stats_clients = {}
+        self.chat_history = deque()     # frame chat lengkap (header panjang + isi)
+        self.chat_history_bytes = 0
+        self.chat_dirty = {}            # ChatConn dengan outbuf baru, urutan sisip
+        self.started = time.monotonic()
+        self.fanout_latency = Histogram(FANOUT_BUCKETS)
+        self.frame_cache = FrameCache()
+        self.subscriptions = False      # ada peer yang berlangganan (jalur cepat bila tidak)
+        self.mixer = None
+        self.record = record
+        self.recorder = None
+        if record and self.use_udp:
+            import recorder
+            self.recorder = recorder.Recorder(record)
+            print(f"⏺️ Recording to {record}")
+        if mix:
+            import mixer   # butuh numpy; hanya dimuat di mode MCU
+            self.mixer = mixer.Mixer()
+
+    def open(self):
+        if self.use_udp: self.open_udp()
+        if self.use_tcp: self.open_tcp()
+        if self.use_udp and self.stats_port: self.open_stats()
+        if self.hub is not None:
+            self.sel.register(self.hub, selectors.EVENT_READ, self.on_hub)
+
+    def open_udp(self):
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reuseport:
+            self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try: self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024 * 10)
+        except: pass
+        try: self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024 * 10)
+        except: pass
+        self.udp_sock.bind((self.host, UDP_PORT))
+        self.udp_sock.setblocking(False)
+        self.sel.register(self.udp_sock, selectors.EVENT_READ, self.on_udp)
+        print(f"✅ UDP Server (Video) running on {self.host}:{UDP_PORT}")
+        self.add_timer(SWEEP_INTERVAL, self.sweep_udp_clients)
+        self.add_timer(STATS_INTERVAL, self.report_drops)
+        self.add_timer(SPEAKER_INTERVAL, self.update_speakers)
+        if self.mixer is not None: self.add_timer(MIX_TICK, self.mix_audio)
+
+    def open_tcp(self):
+        self.tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp_sock.bind((self.host, TCP_CHAT_PORT))
+        self.tcp_sock.listen(64)
+        self.tcp_sock.setblocking(False)
+        self.sel.register(self.tcp_sock, selectors.EVENT_READ, self.on_accept)
+        print(f"✅ TCP Server (Chat) running on {self.host}:{TCP_CHAT_PORT}")
+
+    def open_stats(self):
+        # Hanya localhost: angka per peer memuat alamat IP peserta
+        self.stats_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.stats_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try: self.stats_sock.bind(('127.0.0.1', self.stats_port))
+        except OSError as e:
+            print(f"⚠️ Stats port {self.stats_port} unavailable: {e}")
+            self.stats_sock.close()
+            self.stats_sock = None
+            return
+        self.stats_sock.listen(8)
+        self.stats_sock.setblocking(False)
+        self.sel.register(self.stats_sock, selectors.EVENT_READ, self.on_stats_accept)
+        print(f"📊 Stats on http://127.0.0.1:{self.stats_port}/stats and /metrics")
+
+    def add_timer(self, interval, fn):
+        self.timers.append([time.monotonic() + interval, interval, fn])
+
+    def run_timers(self):
+        now = time.monotonic()
+        for t in self.timers:
+            if t[0] <= now:
+                t[0] = now + t[1]
+                try: t[2]()
+                except Exception as e: print(f"Timer Error: {e}")
+        return min(t[0] for t in self.timers) - now if self.timers else 1.0
+
+    def serve(self):
+        while self.running:
+            timeout = max(0, self.run_timers())
+            for key, mask in self.sel.select(timeout):
+                try: key.data(key.fileobj, mask)
+                except Exception as e: print(f"Loop Error: {e}")
+            if self.chat_dirty: self.flush_chat()
+
+    # UDP
+    def on_udp(self, sock, mask):
+        if mask & selectors.EVENT_WRITE:
+            self.drain()
+        if not mask & selectors.EVENT_READ: return
+        for _ in range(UDP_BATCH):
+            try:
+                data, addr = sock.recvfrom(65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue
+            if not data: continue
+            peer = self.peers.get(addr)
+            if peer is None or not peer.local:
+                print(f"🎥 New UDP Client: {addr}")
+                peer = self.peers[addr] = Peer(addr)
+                self.announce(b'J', [addr])
+                if self.ranking: self.send_speakers({addr})
+                self.send_cached(addr, time.monotonic())
+            now = peer.last_seen = time.monotonic()
+            peer.pkts_in += 1
+            peer.bytes_in += len(data)
+            if data[0] == protocol.VIDEO:
+                head = protocol.parse_video(data)
+                if head is None: continue   # versi lain / header terpotong: jangan diteruskan atau di-cache
+                if self.recorder: self.recorder.write(data, peer.name or b'', now)
+                seq, _, idx, total, _, _, flags, _ = head
+                layer = (flags >> 2) & 3
+                peer.video_flags = flags
+                peer.offcam = None
+                if not flags & protocol.FLAG_DELTA: self.frame_cache.add((addr, layer), data, seq, idx, total)
+                peer.layers[layer] = now
+                targets = self.video_targets(peer)
+                if self.subscriptions:
+                    targets = self.subscription_targets(peer, seq, layer,
+                                                        flags & protocol.FLAG_DELTA, now, targets)
+                if len(peer.layers) > 1:
+                    self.fanout_layer(data, addr, peer, layer, now, targets)
+                    continue
+                self.fanout(data, addr, targets)
+                continue
+            head = protocol.parse_ctrl(data)
+            if head is None: continue   # versi lain / bukan paket Locus: jangan diteruskan
+            kind, off = head
+            name = data[protocol.CTRL_SIZE:off]
+            if name != peer.name:
+                if self.names.get(peer.name) == addr: del self.names[peer.name]
+                peer.name = name
+                self.names[name] = addr
+                self.spoke.setdefault(name, float('-inf'))
+                self.speaker_seen[name] = now
+            if kind in protocol.ROUTED:
+                # Rutekan ke pengirim yang dituju; nama di worker lain tidak dikenal -> siarkan
+                dest = self.names.get(protocol.routed_target(data[off:])) if off < len(data) else None
+                self.fanout(data, addr, {dest} if dest else None)
+                continue
+            if kind == protocol.LAYER:
+                if off < len(data) and data[off] != peer.layer:
+                    peer.layer = min(data[off], 3)
+                    self.announce(b'J', [addr])
+                continue
+            if kind == protocol.PIN:
+                peer.pinned = set(protocol.unpack_names(data, off))
+                self.announce_pins(peer)
+                continue
+            if kind == protocol.SUBSCRIBE:
+                self.set_subscriptions(peer, protocol.unpack_subscriptions(data, off))
+                self.announce_subscriptions(peer, data[off:])
+                continue
+            if self.recorder and kind in (protocol.AUDIO, protocol.COMFORT_NOISE, protocol.OFFCAM):
+                self.recorder.write(data, name, now)
+            if kind == protocol.COMFORT_NOISE: peer.loud = 0   # VAD pengirim: jeda bicara
+            if kind == protocol.OFFCAM:
+                peer.offcam = data
+                self.frame_cache.drop(addr)
+            if kind == protocol.AUDIO and off + 2 < len(data):
+                self.on_audio_level(peer, data[off + 2], now)
+                if self.mixer is not None:
+                    seq, level, pcm = protocol.unpack_audio(data[off:])
+                    self.mixer.push(addr, seq, level, pcm)
+                    continue
+            self.fanout(data, addr)
+
+    # Last-N active speakers
+    def on_audio_level(self, peer, level, now):
+        if level > SPEECH_LEVEL:
+            peer.loud = 0
+            return
+        peer.loud += 1
+        if peer.loud < SPEECH_PACKETS or peer.name is None: return
+        self.spoke[peer.name] = now
+        if self.hub is not None and now - peer.spoke_announced >= SPEAKER_ANNOUNCE:
+            peer.spoke_announced = now
+            self.announce_speakers([peer.name], now)
+
+    def video_targets(self, peer):
+        # None = semua penerima; pengirim di luar N terakhir hanya ke penerima yang mem-pin-nya
+        if not self.last_n or peer.name is None or peer.name in self.active: return None
+        return {a for a, p in self.peers.items() if peer.name in p.pinned}
+
+    def update_speakers(self):
+        now = time.monotonic()
+        for name in self.names: self.speaker_seen[name] = now
+        cutoff = now - CLIENT_TIMEOUT
+        for name in [n for n, t in self.speaker_seen.items() if t < cutoff]:
+            del self.speaker_seen[name]
+            self.spoke.pop(name, None)
+        # Sort stabil: yang belum pernah bicara tetap urut join, mengisi sisa slot N
+        ranking = sorted(self.spoke, key=self.spoke.get, reverse=True)
+        if ranking[:SPEAKERS_MAX] != self.ranking[:SPEAKERS_MAX]:
+            self.ranking = ranking
+            self.send_speakers()
+        self.ranking = ranking
+        self.active = set(ranking[:self.last_n])
+
+    def send_speakers(self, targets=None):
+        if targets is None: targets = {a for a, p in self.peers.items() if p.local}
+        msg = protocol.pack_ctrl(protocol.SPEAKERS, b'', protocol.pack_names(self.ranking[:SPEAKERS_MAX]))
+        self.fanout(msg, None, targets)
 
-    while server_running:
+    # MCU audio
+    def mix_audio(self):
+        now = time.monotonic()
+        for _ in range(self.mixer.due(now)):
+            for addr, body in self.mixer.mix(list(self.peers), now):
+                self.send_one(addr, protocol.pack_ctrl(protocol.AUDIO, self.mixer.user, body), now)
+
+    def send_one(self, addr, data, now):
+        peer = self.peers.get(addr)
+        if peer is None: return
+        if not self.pending:
+            try:
+                self.udp_sock.sendto(data, addr)
+                peer.sent += 1
+                peer.bytes_out += len(data)
+                return
+            except BlockingIOError: pass
+            except OSError:
+                peer.errors += 1
+                return
+        peer.push(data, now)
+        self.pending[addr] = None
+        if not self.udp_writable: self.set_udp_writable(True)
+
+    def send_cached(self, dest, now):
+        """Give a newly seen peer every local sender's last frame (or camera-off state) right away."""
+        wanted = self.peers[dest].layer if dest in self.peers else 0
+        for src, peer in list(self.peers.items()):
+            if src == dest or not peer.local: continue
+            if peer.offcam is not None:
+                self.send_one(dest, peer.offcam, now)
+                continue
+            frames = self.frame_cache.layers(src)
+            if not frames: continue
+            targets = self.video_targets(peer)
+            if targets is not None and dest not in targets: continue
+            # Frame cache bisa lebih tua dari status mute/deaf pengirim: bit itu diganti yang terkini
+            state = peer.video_flags & (protocol.FLAG_MUTE | protocol.FLAG_DEAF) | protocol.FLAG_CACHED
+            for frag in frames[pick_layer(frames, wanted)]:
+                off = protocol.video_flags_offset(frag)
+                frag = bytearray(frag)
+                frag[off] = frag[off] & ~(protocol.FLAG_MUTE | protocol.FLAG_DEAF) | state
+                self.send_one(dest, frag, now)
+
+    # Langganan penerima
+    def set_subscriptions(self, peer, subs):
+        peer.subs = subs
+        for key in [k for k in peer.sub_state if k[0] not in subs]: del peer.sub_state[key]
+        self.subscriptions = True
+
+    def wanted_layer(self, p, sender):
+        if p.subs is None: return p.layer
+        sub = p.subs.get(sender.name)
+        return sub[0] if sub else THUMB_LAYER
+
+    def subscription_targets(self, sender, seq, layer, delta, now, targets):
+        """Receivers of frame `seq` of one simulcast layer under their subscriptions; decided once per frame."""
+        # Per layer: tiap encoder layer memutuskan keyframe/delta sendiri, jadi rantai delta juga per layer
+        cached = sender.sub_frame.get(layer)
+        if cached is not None and cached[0] == seq: return cached[1]
+        allowed = set()
+        name = sender.name
+        for addr, p in self.peers.items():
+            if addr == sender.addr or (targets is not None and addr not in targets): continue
+            if p.subs is None:
+                allowed.add(addr)
+                continue
+            sub = p.subs.get(name) if name is not None else None
+            fps = sub[1] if sub else THUMB_FPS
+            if not fps:
+                allowed.add(addr)   # digambar tanpa batas fps: semua frame
+                continue
+            st = p.sub_state.get((name, layer))
+            if st is None: st = p.sub_state[name, layer] = [0.0, False]
+            # Frame yang dilewati memutus rantai delta: delta berikutnya ikut dibuang sampai frame independen.
+            # Thumbnail tidak pernah menerima delta.
+            if delta: ok = st[1] and sub is not None
+            else: ok = now >= st[0]
+            if ok and not delta: st[0] = now + 0.9 / fps
+            st[1] = ok
+            if ok: allowed.add(addr)
+        sender.sub_frame[layer] = (seq, allowed)
+        return allowed
+
+    def announce_subscriptions(self, peer, body):
+        if self.hub is None: return
+        a = peer.addr
+        try: self.hub.send(b'U' + HUB_ADDR.pack(socket.inet_aton(a[0]), a[1], peer.layer) + bytes(body))
+        except OSError: pass
+
+    def fanout_layer(self, data, src, peer, layer, now, targets=None):
+        cutoff = now - LAYER_TTL
+        for l in [l for l, t in peer.layers.items() if t < cutoff]: del peer.layers[l]
+        available = list(peer.layers)
+        if len(available) <= 1:
+            self.fanout(data, src, targets)
+            return
+        chosen = {}
+        wanted = set()
+        for addr, p in self.peers.items():
+            if targets is not None and addr not in targets: continue
+            w = self.wanted_layer(p, peer)
+            if w not in chosen: chosen[w] = pick_layer(available, w)
+            if chosen[w] == layer: wanted.add(addr)
+        self.fanout(data, src, wanted)
+
+    def fanout(self, data, src, targets=None):
+        # Jalur cepat: kirim langsung selama socket tidak penuh; begitu EAGAIN,
+        # sisanya masuk antrian per penerima dan dikuras saat EVENT_WRITE.
+        t0 = time.perf_counter()
+        now = time.monotonic()
+        sendto = self.udp_sock.sendto
+        size = len(data)
+        for addr, peer in self.peers.items():
+            if addr == src or (targets is not None and addr not in targets): continue
+            if self.pending:
+                peer.push(data, now)
+                self.pending[addr] = None
+                continue
+            try:
+                sendto(data, addr)
+                peer.sent += 1
+                peer.bytes_out += size
+            except BlockingIOError:
+                peer.push(data, now)
+                self.pending[addr] = None
+            except OSError:
+                peer.errors += 1
+        if self.pending and not self.udp_writable:
+            self.set_udp_writable(True)
+        self.fanout_latency.observe(time.perf_counter() - t0)
+
+    def drain(self):
+        now = time.monotonic()
+        sendto = self.udp_sock.sendto
+        while self.pending:
+            for addr in list(self.pending):
+                peer = self.peers.get(addr)
+                data = peer.pop(now) if peer else None
+                if data is None:
+                    del self.pending[addr]
+                    continue
+                try:
+                    sendto(data, addr)
+                    peer.sent += 1
+                    peer.bytes_out += len(data)
+                except BlockingIOError:
+                    peer.requeue(data, now)
+                    return
+                except OSError:
+                    peer.errors += 1
+        self.set_udp_writable(False)
+
+    def set_udp_writable(self, on):
+        self.udp_writable = on
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if on else 0)
+        self.sel.modify(self.udp_sock, events, self.on_udp)
+
+    def sweep_udp_clients(self):
+        if self.hub is not None and os.getppid() != self.parent_pid:
+            self.running = False   # parent mati; jangan tinggalkan worker yatim memegang port
+            return
+        cutoff = time.monotonic() - CLIENT_TIMEOUT
+        left = []
+        for addr in [a for a, p in self.peers.items() if p.last_seen < cutoff]:
+            peer = self.peers.pop(addr)
+            self.pending.pop(addr, None)
+            if self.names.get(peer.name) == addr: del self.names[peer.name]
+            self.frame_cache.drop(addr)
+            if peer.local:
+                print(f"💤 UDP Client timeout: {addr} {peer.stats()}")
+                left.append(addr)
+        self.subscriptions = any(p.subs is not None for p in self.peers.values())
+        # Re-announce tiap sweep supaya worker lain bisa expire entri yang hilang
+        self.announce(b'L', left)
+        self.announce(b'J', [a for a, p in self.peers.items() if p.local])
+        self.announce_speakers([p.name for p in self.peers.values() if p.local and p.name is not None], time.monotonic())
+
+    def stats(self):
+        h = self.fanout_latency
+        return {'worker': self.worker, 'uptime': round(time.monotonic() - self.started, 1),
+                'peers': {f"{a[0]}:{a[1]}": p.stats() for a, p in self.peers.items()},
+                'queue_depth': sum(len(p.ctrl) + len(p.video) for p in self.peers.values()),
+                'pending_peers': len(self.pending), 'chat_clients': len(self.tcp_clients),
+                'chat_history': len(self.chat_history), 'frame_cache_bytes': self.frame_cache.bytes,
+                'fanout_latency': {'buckets': {('+Inf' if le == float('inf') else le): c for le, c in h.cumulative()},
+                                   'sum': h.sum, 'count': h.count}}
+
+    def metrics(self):
+        lines = []
+        def escape(v):
+            # Text format Prometheus: backslash, kutip dan newline di nilai label wajib di-escape
+            return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP locus_{name} {help}")
+            lines.append(f"# TYPE locus_{name} {kind}")
+            for labels, v in samples:
+                lab = ",".join(f'{k}="{escape(x)}"' for k, x in labels.items())
+                lines.append(f"locus_{name}{{{lab}}} {v}")
+        w = {'worker': str(self.worker)}
+        peers = [(dict(w, peer=f"{a[0]}:{a[1]}", name=(p.name or b'').decode('utf-8', 'replace')), p)
+                 for a, p in self.peers.items() if p.local]
+        metric('peer_packets_in_total', 'counter', 'UDP packets received from the peer', [(l, p.pkts_in) for l, p in peers])
+        metric('peer_bytes_in_total', 'counter', 'UDP bytes received from the peer', [(l, p.bytes_in) for l, p in peers])
+        metric('peer_packets_out_total', 'counter', 'UDP packets forwarded to the peer', [(l, p.sent) for l, p in peers])
+        metric('peer_bytes_out_total', 'counter', 'UDP bytes forwarded to the peer', [(l, p.bytes_out) for l, p in peers])
+        metric('peer_drops_total', 'counter', 'Packets dropped from the peer send queue',
+               [(dict(l, kind='video'), p.drops_video) for l, p in peers] + [(dict(l, kind='ctrl'), p.drops_ctrl) for l, p in peers])
+        metric('peer_queue_depth', 'gauge', 'Packets waiting in the peer send queue',
+               [(l, len(p.ctrl) + len(p.video)) for l, p in peers])
+        metric('peers', 'gauge', 'Known UDP peers (all workers)', [(w, len(self.peers))])
+        metric('chat_clients', 'gauge', 'Connected TCP chat clients', [(w, len(self.tcp_clients))])
+        h = self.fanout_latency
+        metric('fanout_latency_seconds', 'histogram', 'Time to fan out one received packet', [])
+        for le, c in h.cumulative():
+            le = '+Inf' if le == float('inf') else repr(le)
+            lines.append(f'locus_fanout_latency_seconds_bucket{{worker="{self.worker}",le="{le}"}} {c}')
+        lines.append(f'locus_fanout_latency_seconds_sum{{worker="{self.worker}"}} {h.sum}')
+        lines.append(f'locus_fanout_latency_seconds_count{{worker="{self.worker}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    # Stats HTTP: satu request per koneksi, dilayani di loop yang sama tanpa blocking
+    def on_stats_accept(self, sock, mask):
+        try: conn, _ = sock.accept()
+        except BlockingIOError: return
+        conn.setblocking(False)
+        self.sel.register(conn, selectors.EVENT_READ, self.on_stats_conn)
+        self.stats_clients[conn] = StatsConn(conn)
+
+    def on_stats_conn(self, sock, mask):
+        c = self.stats_clients.get(sock)
+        if c is None: return
+        if mask & selectors.EVENT_READ and not c.outbuf:
+            try: data = sock.recv(4096)
+            except BlockingIOError: return
+            except OSError: data = b''
+            c.inbuf += data
+            if data and b'\r\n\r\n' not in c.inbuf and b'\n\n' not in c.inbuf and len(c.inbuf) < 8192: return
+            parts = bytes(c.inbuf).split(b' ', 2)
+            path = parts[1].split(b'?')[0] if len(parts) > 1 else b''
+            if path == b'/metrics':
+                status, ctype, body = '200 OK', 'text/plain; version=0.0.4', self.metrics().encode()
+            elif path in (b'/', b'/stats'):
+                status, ctype, body = '200 OK', 'application/json', json.dumps(self.stats()).encode()
+            else:
+                status, ctype, body = '404 Not Found', 'text/plain', b'not found\n'
+            c.outbuf = (f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                        f"Connection: close\r\n\r\n").encode() + body
+        if c.outbuf:
+            try: c.outbuf = c.outbuf[sock.send(c.outbuf):]
+            except BlockingIOError: pass
+            except OSError: c.outbuf = b''
+            if c.outbuf:
+                self.sel.modify(sock, selectors.EVENT_WRITE, self.on_stats_conn)
+                return
+        self.close_stats(sock)
+
+    def close_stats(self, sock):
+        self.stats_clients.pop(sock, None)
+        try: self.sel.unregister(sock)
+        except (KeyError, ValueError): pass
+        sock.close()
+
+    def report_drops(self):
+        for addr, peer in self.peers.items():
+            drops = peer.drops_video + peer.drops_ctrl
+            if drops != peer.reported_drops:
+                print(f"⚠️ Drops {addr}: video={peer.drops_video} ctrl={peer.drops_ctrl} queued={len(peer.ctrl) + len(peer.video)}")
+                peer.reported_drops = drops
+
+    # Worker registry
+    def announce(self, op, addrs):
+        if self.hub is None or not addrs: return
+        for i in range(0, len(addrs), HUB_MAX_ADDRS):
+            msg = op + b''.join(HUB_ADDR.pack(socket.inet_aton(a[0]), a[1], self.peers[a].layer if a in self.peers else 0)
+                                for a in addrs[i:i + HUB_MAX_ADDRS])
+            try: self.hub.send(msg)
+            except OSError: pass
+
+    def announce_speakers(self, names, now):
+        if self.hub is None or not names: return
+        recs = []
+        for name in names:
+            t = self.spoke.get(name, float('-inf'))
+            age = NEVER_SPOKE if t == float('-inf') else min(NEVER_SPOKE - 1, int((now - t) * 1000))
+            recs.append(HUB_SPEAKER.pack(age, len(name)) + name)
+        for i in range(0, len(recs), HUB_MAX_ADDRS):
+            try: self.hub.send(b'S' + b''.join(recs[i:i + HUB_MAX_ADDRS]))
+            except OSError: pass
+
+    def announce_pins(self, peer):
+        if self.hub is None: return
+        a = peer.addr
+        try: self.hub.send(b'P' + HUB_ADDR.pack(socket.inet_aton(a[0]), a[1], peer.layer) + protocol.pack_names(list(peer.pinned)))
+        except OSError: pass
+
+    def on_hub(self, sock, mask):
+        try: msg = sock.recv(65536)
+        except OSError: return
+        if not msg: return
+        now = time.monotonic()
+        op = msg[:1]
+        if op == b'S':
+            off = 1
+            while off + HUB_SPEAKER.size <= len(msg):
+                age, n = HUB_SPEAKER.unpack_from(msg, off)
+                name = msg[off + HUB_SPEAKER.size:off + HUB_SPEAKER.size + n]
+                off += HUB_SPEAKER.size + n
+                if name in self.names: continue   # peer lokal: sumber kebenarannya di sini
+                self.spoke[name] = float('-inf') if age == NEVER_SPOKE else now - age / 1000
+                self.speaker_seen[name] = now
+            return
+        if op == b'P':
+            if len(msg) < 1 + HUB_ADDR.size: return
+            ip, port, _ = HUB_ADDR.unpack_from(msg, 1)
+            peer = self.peers.get((socket.inet_ntoa(ip), port))
+            if peer is not None and not peer.local:
+                peer.pinned = set(protocol.unpack_names(msg, 1 + HUB_ADDR.size))
+            return
+        if op == b'U':
+            if len(msg) < 1 + HUB_ADDR.size: return
+            ip, port, _ = HUB_ADDR.unpack_from(msg, 1)
+            peer = self.peers.get((socket.inet_ntoa(ip), port))
+            if peer is not None and not peer.local:
+                self.set_subscriptions(peer, protocol.unpack_subscriptions(msg, 1 + HUB_ADDR.size))
+            return
+        for off in range(1, len(msg) - HUB_ADDR.size + 1, HUB_ADDR.size):
+            ip, port, layer = HUB_ADDR.unpack_from(msg, off)
+            addr = (socket.inet_ntoa(ip), port)
+            peer = self.peers.get(addr)
+            if peer is not None and peer.local: continue
+            if op == b'J':
+                new = peer is None
+                if new: peer = self.peers[addr] = Peer(addr, local=False)
+                peer.last_seen = now
+                peer.layer = layer
+                if new: self.send_cached(addr, now)   # peer baru di worker lain: frame pengirim lokal di sini
+            elif peer is not None:
+                del self.peers[addr]
+                self.pending.pop(addr, None)
+
+    def attach_worker(self, hub):
+        self.worker_hubs.append(hub)
+        self.sel.register(hub, selectors.EVENT_READ, self.on_worker_hub)
+
+    def on_worker_hub(self, sock, mask):
+        try: msg = sock.recv(65536)
+        except OSError: return
+        if not msg: return
+        for h in self.worker_hubs:
+            if h is not sock:
+                try: h.send(msg)
+                except OSError: pass
+
+    # TCP
+    def on_accept(self, sock, mask):
         try:
-            udp_sock.settimeout(1.0) 
+            client, addr = sock.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(False)
+        conn = ChatConn(client, addr)
+        self.tcp_clients[client] = conn
+        self.sel.register(client, selectors.EVENT_READ, self.on_chat)
+        print(f"🔗 TCP Chat Connected: {addr}")
+        if self.chat_history:
+            # Riwayat sudah dalam bentuk frame siap kirim: satu join, dikirim bersama flush berikutnya
+            conn.outbuf += b''.join(self.chat_history)
+            self.chat_dirty[conn] = None
+
+    def on_chat(self, sock, mask):
+        conn = self.tcp_clients.get(sock)
+        if conn is None: return
+        if mask & selectors.EVENT_WRITE:
+            self.flush(conn)
+        if mask & selectors.EVENT_READ:
+            try:
+                data = sock.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b''
+            if not data:
+                self.drop_chat(conn)
+                return
+            conn.inbuf += data
+            while len(conn.inbuf) >= 4:
+                length = int.from_bytes(conn.inbuf[:4], 'big')
+                if len(conn.inbuf) < 4 + length: break
+                msg = bytes(conn.inbuf[:4 + length])
+                del conn.inbuf[:4 + length]
+                self.broadcast_chat(msg, conn)
+
+    def broadcast_chat(self, msg, src):
+        self.chat_history.append(msg)
+        self.chat_history_bytes += len(msg)
+        while len(self.chat_history) > CHAT_HISTORY or self.chat_history_bytes > CHAT_HISTORY_BYTES:
+            self.chat_history_bytes -= len(self.chat_history.popleft())
+        # Hanya antre di sini; flush_chat mengirim semua pesan satu putaran select() sekaligus
+        for conn in list(self.tcp_clients.values()):
+            if conn is not src:
+                conn.outbuf += msg
+                if len(conn.outbuf) > CHAT_MAX_BUFFER:
+                    print(f"⚠️ Chat peer macet, diputus: {conn.addr}")
+                    self.drop_chat(conn)
+                    continue
+                self.chat_dirty[conn] = None
+
+    def flush_chat(self):
+        dirty, self.chat_dirty = self.chat_dirty, {}
+        for conn in dirty:
+            if conn.sock in self.tcp_clients: self.flush(conn)
+
+    def flush(self, conn):
+        if conn.outbuf:
             try:
-                data, addr = udp_sock.recvfrom(65536)
-            except socket.timeout:
-                continue 
-
-            with lock:
-                # Register Client
-                if addr not in udp_clients:
-                    print(f"🎥 New UDP Client: {addr}")
-                udp_clients[addr] = time.time()
-                
-                # Cleanup
-                cutoff = time.time() - 5
-                inactive = [k for k, v in udp_clients.items() if v < cutoff]
-                for k in inactive: del udp_clients[k]
-                
-                targets = list(udp_clients.keys())
-
-            # Broadcast
-            for target in targets:
-                if target != addr:
-                    try: udp_sock.sendto(data, target)
-                    except: pass
-        except Exception as e: 
-            print(f"UDP Loop Error: {e}")
-    
-    udp_sock.close()
-
-def handle_tcp(client, addr):
-    print(f"🔗 TCP Chat Connected: {addr}")
-    with lock:
-        tcp_clients.append(client)
+                sent = conn.sock.send(conn.outbuf)
+                del conn.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.drop_chat(conn)
+                return
+        writing = bool(conn.outbuf)
+        if writing == conn.writing: return
+        conn.writing = writing
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+        try: self.sel.modify(conn.sock, events, self.on_chat)
+        except (KeyError, ValueError): pass
+
+    def drop_chat(self, conn):
+        if self.tcp_clients.pop(conn.sock, None) is None: return
+        print(f"❌ TCP Disconnected: {conn.addr}")
+        try: self.sel.unregister(conn.sock)
+        except (KeyError, ValueError): pass
+        conn.sock.close()
+
+    def close(self):
+        self.running = False
+        for conn in list(self.tcp_clients.values()):
+            self.drop_chat(conn)
+        for sock in list(self.stats_clients): self.close_stats(sock)
+        if self.recorder:
+            self.recorder.close()
+            print(f"⏺️ Recorded {self.recorder.packets} packets ({self.recorder.dropped} dropped)")
+        for s in [self.udp_sock, self.tcp_sock, self.stats_sock, self.hub] + self.worker_hubs:
+            if s is None: continue
+            try: self.sel.unregister(s)
+            except (KeyError, ValueError): pass
+            s.close()
+        self.sel.close()
+
+
+def run_worker(host, hub, last_n=0, stats_port=0, worker=0, record=None):
+    relay = Relay(host, tcp=False, hub=hub, reuseport=True, last_n=last_n, stats_port=stats_port, worker=worker,
+                  record=record)
     try:
-        while server_running:
-            header = client.recv(4)
-            if not header: break
-            length = int.from_bytes(header, 'big')
-            data = b''
-            while len(data) < length:
-                chunk = client.recv(length - len(data))
-                if not chunk: break
-                data += chunk
-            
-            if len(data) == length:
-                msg = header + data
-                with lock:
-                    for c in tcp_clients:
-                        if c != client:
-                            try: c.sendall(msg)
-                            except: pass
-            else: break
-    except: pass
+        relay.open()
+        relay.serve()
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"❌ Worker gagal bind UDP: {e}")
     finally:
-        print(f"❌ TCP Disconnected: {addr}")
-        with lock:
-            if client in tcp_clients: tcp_clients.remove(client)
-        client.close()
-
-def tcp_listener():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, TCP_CHAT_PORT))
-    server.listen(5)
-    server.settimeout(1.0)
-    print(f"✅ TCP Server (Chat) running on {HOST}:{TCP_CHAT_PORT}")
-    
-    while server_running:
-        try:
-            client, addr = server.accept()
-            threading.Thread(target=handle_tcp, args=(client, addr), daemon=True).start()
-        except socket.timeout:
-            continue
-        except Exception as e:
-            print(f"TCP Accept Error: {e}")
-    server.close()
+        relay.close()
+
+
+def start_workers(relay, count):
+    procs = []
+    for k in range(count):
+        parent_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Non-blocking di kedua ujung: antrean hub penuh = update dibuang (BlockingIOError ditangkap sebagai
+        # OSError di setiap send), bukan loop select yang macet. Re-announce tiap sweep memulihkannya.
+        parent_end.setblocking(False)
+        worker_end.setblocking(False)
+        stats_port = relay.stats_port + k if relay.stats_port else 0
+        # Tiap worker merekam paketnya sendiri; recorder.py replay menggabungkan direktori-direktori ini
+        record = os.path.join(relay.record, f"worker{k}") if relay.record else None
+        p = multiprocessing.Process(target=run_worker, args=(relay.host, worker_end, relay.last_n, stats_port, k, record),
+                                    daemon=True)
+        p.start()
+        worker_end.close()
+        relay.attach_worker(parent_end)
+        procs.append(p)
+    return procs
+
 
 if __name__ == "__main__":
-    t_udp = threading.Thread(target=udp_listener, daemon=True)
-    t_tcp = threading.Thread(target=tcp_listener, daemon=True)
-    
-    t_udp.start()
-    t_tcp.start()
-    
+    parser = argparse.ArgumentParser(description="Locus relay server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="jumlah proses UDP (SO_REUSEPORT); 1 = satu proses untuk UDP dan chat")
+    parser.add_argument("--mix", action="store_true",
+                        help="mode MCU: server mencampur audio menjadi satu stream per penerima (butuh numpy, 1 worker)")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT,
+                        help="port stats HTTP lokal (worker k: port + k); 0 = mati")
+    parser.add_argument("--record", metavar="DIR",
+                        help="rekam paket video/audio yang diteruskan ke DIR (lihat recorder.py)")
+    parser.add_argument("--last-n", type=int, default=0,
+                        help="teruskan video hanya untuk N pembicara terakhir (plus yang di-pin); 0 = semua")
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    workers = args.workers
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print("⚠️ SO_REUSEPORT tidak tersedia di OS ini, memakai 1 worker.")
+        workers = 1
+    if workers > 1 and args.mix:
+        print("⚠️ --mix butuh semua audio di satu proses, memakai 1 worker.")
+        workers = 1
+
+    if args.record and any(os.path.exists(os.path.join(d, 'index.idx')) for d in
+                           [args.record] + [os.path.join(args.record, f"worker{k}") for k in range(workers)]):
+        print(f"❌ {args.record} sudah berisi rekaman, pilih direktori lain.")
+        sys.exit(1)
+
+    relay = Relay(args.host, udp=(workers == 1), last_n=max(0, args.last_n), mix=args.mix,
+                  stats_port=args.stats_port, record=args.record)
+    procs = []
+    try:
+        relay.open()
+        if workers > 1:
+            procs = start_workers(relay, workers)
+            print(f"⚙️ {workers} UDP workers (SO_REUSEPORT)")
+    except OSError as e:
+        print(f"❌ Gagal bind: {e}")
+        sys.exit(1)
+
     print("🚀 SERVER BERJALAN. Tekan Ctrl+C untuk mematikan.")
-    
+
     try:
-        while True: time.sleep(1)
+        relay.serve()
     except KeyboardInterrupt:
         print("\n🛑 MEMATIKAN SERVER...")
-        server_running = False
-        
-        with lock:
-            for client in tcp_clients:
-                try: client.close()
-                except: pass
-        print("👋 Server Off.")
\ No newline at end of file
+    finally:
+        relay.close()
+        for p in procs: p.terminate()
+        for p in procs: p.join(timeout=2)
+        print("👋 Server Off.")